@@ -0,0 +1,97 @@
+#! python3
+# 异步并发抓取
+# 阻塞的 httpclient 调用放到线程池里执行，asyncio 负责控制并发数和每个站点的请求频率
+# AsyncFetcher 需要在事件循环中创建，例如 asyncio.run(main()) 的 main 里
+#
+
+import asyncio
+import functools
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+import httpclient
+
+
+class RateLimiter:
+    """
+    每个站点两次请求开始之间至少间隔 1 / rate 秒
+    """
+
+    def __init__(self, rate):
+        """
+        :param rate: 每个站点每秒最多请求数，0 表示不限
+        """
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next = {}  # 站点 -> 下一次允许请求的时间
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next.get(host, now))
+        self.next[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncFetcher:
+    """
+    并发抓取器
+    """
+
+    def __init__(self, concurrency=8, rate=0, headers=None, get=None):
+        """
+        :param concurrency: 同时进行的请求数
+        :param rate: 每个站点每秒最多请求数，0 表示不限
+        :param headers: 默认请求头
+        :param get: 实际发送请求的函数，默认共用连接池的 httpclient.get，
+            此时连接池的上限会扩大到 concurrency
+        """
+        if get is None:
+            httpclient.configure(concurrency)
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rate)
+        self.headers = headers
+        self.getFunc = get or httpclient.get
+        self.executor = ThreadPoolExecutor(concurrency)
+
+    async def get(self, url, **kwargs):
+        """
+        :param url: 链接
+        :return: requests.Response
+        """
+        kwargs.setdefault('headers', self.headers)
+        async with self.semaphore:
+            await self.limiter.wait(urlsplit(url).netloc)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor, functools.partial(self.getFunc, url, **kwargs))
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+async def orderedResults(coroutines, window):
+    """
+    并发执行，按原顺序逐个产出结果
+    最多同时排队 window 个任务，已完成但未轮到的结果不会无限堆积
+
+    :param coroutines: 协程的可迭代对象
+    :param window: 最多提前调度的任务数
+    """
+    pending = []
+    iterator = iter(coroutines)
+    for coroutine in iterator:
+        pending.append(asyncio.ensure_future(coroutine))
+        if len(pending) >= window:
+            break
+    try:
+        while pending:
+            result = await pending.pop(0)
+            for coroutine in iterator:
+                pending.append(asyncio.ensure_future(coroutine))
+                break
+            yield result
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,248 @@
+#! python3
+#
+# 2048 NumPy 批量棋盘运算
+# 一次处理一组位棋盘(np.uint64 数组): 移动、合法方向、空格数、静态评估，
+# 以及整层机会节点(每个空格 x {2, 4})的展开与期望值
+# 查找表与 board2048 / heuristic2048 相同，结果逐个一致
+#
+# Usage: python batch2048.py [棋盘数]  对比逐个评估与批量评估的速度
+#
+
+import sys
+import time
+import random
+import numpy as np
+import board2048
+from heuristic2048 import Heuristic
+from search2048 import lostScore, tileProbabilities
+
+rowMask = np.uint64(0xFFFF)
+shifts = [np.uint64(4 * idx) for idx in range(16)]
+rowShifts = [np.uint64(16 * y) for y in range(4)]
+colShifts = [np.uint64(4 * x) for x in range(4)]
+
+rowLeftTable = np.array(board2048.rowLeftTable, dtype=np.uint64)
+rowRightTable = np.array(board2048.rowRightTable, dtype=np.uint64)
+colUpTable = np.array(board2048.colUpTable, dtype=np.uint64)
+colDownTable = np.array(board2048.colDownTable, dtype=np.uint64)
+
+
+def toBoards(boards):
+    """
+    位棋盘列表转成 np.uint64 数组
+    """
+    return np.array(boards, dtype=np.uint64)
+
+
+def rows(boards):
+    """
+    :return: 4 个下标数组，第 y 行
+    """
+    return [((boards >> s) & rowMask).astype(np.intp) for s in rowShifts]
+
+
+def transpose(boards):
+    a1 = boards & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & np.uint64(0x0000F0F00000F0F0)
+    a3 = boards & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+def moveBoards(boards, direction):
+    """
+    所有棋盘朝同一方向移动
+
+    :param boards: np.uint64 数组
+    :param direction: 0 up, 1 right, 2 down, 3 left
+    :return: 移动后的棋盘
+    """
+    ret = boards.copy()
+    if direction in (0, 2):
+        table = colUpTable if direction == 0 else colDownTable
+        for s, row in zip(colShifts, rows(transpose(boards))):
+            ret ^= table[row] << s
+    else:
+        table = rowRightTable if direction == 1 else rowLeftTable
+        for s, row in zip(rowShifts, rows(boards)):
+            ret ^= table[row] << s
+    return ret
+
+
+def moveAll(boards):
+    """
+    :return: 形状 (4, n)，第 d 行为朝方向 d 移动后的棋盘
+    """
+    return np.stack([moveBoards(boards, d) for d in range(4)])
+
+
+def legalMoves(boards):
+    """
+    :return: 形状 (n, 4) 的布尔数组，方向可以移动为 True
+    """
+    return (moveAll(boards) != boards).T
+
+
+def countEmpty(boards):
+    x = boards | ((boards >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x |= x >> np.uint64(1)
+    x = ~x & np.uint64(0x1111111111111111)
+    count = np.zeros(len(boards), dtype=np.intp)
+    for s in shifts:
+        count += ((x >> s) & np.uint64(1)).astype(np.intp)
+    return count
+
+
+class BatchHeuristic:
+    """
+    Heuristic 的批量版本，权重变化(version 改变)时自动重新生成数组
+    """
+
+    def __init__(self, heuristic=None):
+        self.heuristic = heuristic if heuristic is not None else Heuristic()
+        self.version = None
+        self.rowTable = None
+        self.colTable = None
+        self.emptyTable = None
+        self.mono2Weight = None
+        self.maxWeight = None
+
+    def refresh(self):
+        if self.version == self.heuristic.version:
+            return
+        # 行: 平滑度, 递减, 递增, 空格数, 最大值  列: 平滑度, 递减, 递增
+        self.rowTable = np.array(self.heuristic.rowTable, dtype=np.float64).T
+        self.colTable = np.array(self.heuristic.colTable, dtype=np.float64).T
+        self.emptyTable = np.array(self.heuristic.emptyTable,
+                                   dtype=np.float64)
+        self.mono2Weight = self.heuristic.mono2Weight
+        self.maxWeight = self.heuristic.maxWeight
+        self.version = self.heuristic.version
+
+    def evaluate(self, boards):
+        """
+        批量静态评估
+
+        :param boards: np.uint64 数组
+        :return: np.float64 数组
+        """
+        self.refresh()
+        smooth, monoDec, monoInc, empty, maxValue = self.rowTable
+        rowIdx = rows(boards)
+        colIdx = rows(transpose(boards))
+
+        score = sum(smooth[r] for r in rowIdx)
+        score += sum(self.colTable[0][c] for c in colIdx)
+        mono = np.maximum(sum(monoDec[r] for r in rowIdx),
+                          sum(monoInc[r] for r in rowIdx))
+        mono += np.maximum(sum(self.colTable[1][c] for c in colIdx),
+                           sum(self.colTable[2][c] for c in colIdx))
+        score += mono * self.mono2Weight
+        emptyCells = sum(empty[r] for r in rowIdx).astype(np.intp)
+        score += self.emptyTable[emptyCells]
+        score += (np.maximum.reduce([maxValue[r] for r in rowIdx])
+                  * self.maxWeight)
+        return score
+
+    __call__ = evaluate
+
+
+def spawnChildren(boards):
+    """
+    展开机会节点: 每个空格分别出现 2 和 4
+
+    :param boards: np.uint64 数组
+    :return: (子棋盘, 对应的父棋盘下标, 概率)
+    """
+    emptyCells = countEmpty(boards)
+    children = []
+    parents = []
+    probs = []
+    index = np.arange(len(boards))
+    for s in shifts:
+        empty = ((boards >> s) & np.uint64(0xF)) == 0
+        if not empty.any():
+            continue
+        base = boards[empty]
+        for rank, p in tileProbabilities:
+            children.append(base | (np.uint64(rank) << s))
+            parents.append(index[empty])
+            probs.append(p / emptyCells[empty])
+    if not children:
+        return (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.intp),
+                np.zeros(0, dtype=np.float64))
+    return (np.concatenate(children), np.concatenate(parents),
+            np.concatenate(probs))
+
+
+def bestMoves(boards, heuristic):
+    """
+    一层玩家节点: 每个棋盘四个方向移动后评估取最大
+
+    :param boards: np.uint64 数组
+    :param heuristic: BatchHeuristic
+    :return: (最大分数, 最佳方向)，无路可走为 (lostScore, -1)
+    """
+    moved = moveAll(boards)
+    scores = heuristic(moved.ravel()).reshape(moved.shape)
+    scores[moved == boards] = lostScore
+    best = scores.argmax(axis=0)
+    value = scores[best, np.arange(len(boards))]
+    best[value == lostScore] = -1
+    return value, best
+
+
+def chanceValues(boards, heuristic):
+    """
+    整层机会节点的期望值(向下搜索一层玩家节点)
+    等价于 Searcher.chanceNode(board, 1, 1.0)，没有空格的棋盘直接静态评估
+
+    :param boards: np.uint64 数组，玩家移动后的棋盘
+    :param heuristic: BatchHeuristic
+    :return: np.float64 数组
+    """
+    children, parents, probs = spawnChildren(boards)
+    values = heuristic(boards)
+    if len(children):
+        childValues, _ = bestMoves(children, heuristic)
+        expected = np.bincount(parents, weights=probs * childValues,
+                               minlength=len(boards))
+        hasEmpty = countEmpty(boards) > 0
+        values[hasEmpty] = expected[hasEmpty]
+    return values
+
+
+def benchmark(count):
+    rnd = random.Random(0)
+    boardList = []
+    for _ in range(count):
+        board = 0
+        for shift in range(0, 64, 4):
+            if rnd.random() < 0.6:
+                board |= rnd.randint(1, 11) << shift
+        boardList.append(board)
+
+    heuristic = Heuristic()
+    batchHeuristic = BatchHeuristic(heuristic)
+    boards = toBoards(boardList)
+    batchHeuristic(boards[:1])
+
+    start = time.perf_counter()
+    for board in boardList:
+        for d in range(4):
+            heuristic(board2048.moveBoard(board, d))
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batchHeuristic(moveAll(boards).ravel())
+    batch = time.perf_counter() - start
+
+    print('%d boards x 4 moves: python %.3fs (%.0f/s) numpy %.3fs (%.0f/s)'
+          % (count, single, 4 * count / single, batch, 4 * count / batch))
+
+
+if __name__ == '__main__':
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -5,75 +5,146 @@
 # 箭头后面的图标
 # 然后便可捕捉需要的元素以及Request Headers
 # 笔趣阁小说抓取
+# 增量模式(-i): 目录和章节用 ETag / Last-Modified 发送条件请求，
+# 只抓新增或有变化的章节，新章节追加到输出文件末尾
+# 查找小说(--find-books): 从首页广度优先并发抓取，找到的小说逐行写入 JSON 目录文件
 #
 
+import os
 import re
+import sys
+import json
+import asyncio
+import argparse
 import requests
-from bs4 import BeautifulSoup
+import httpclient
+import htmlextract
+import bookwriter
+from asyncfetch import AsyncFetcher, orderedResults
+from crawljournal import CrawlJournal
+from sitecrawler import Crawler, VisitedSet, BloomFilter
 
 base_link = 'https://m.biqumo.com'
 book_code = '/6/6919/'  # 小说编码
 
 headers = {
     'User-Agent': 'Mozilla/5.0 (Linux; Android 5.0; SM-G900P Build/LRX21T) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.66 Mobile Safari/537.36'}
-textFile = open('Free soldier king.txt', 'w')
+output_path = 'Free soldier king.txt'
 chapters = []  # 章节列表
 ignoreLink = ['/bookcase.html', '/', '#top']
 bookRegex = re.compile(r'(/\d+/\d+)(/|.html)')
-level = 10
-books = {}  # 小说列表
+level = 10  # 查找深度
+catalog_path = 'books.jsonl'  # 小说目录
+# 去掉翻页提示和空行
+cleanChapter = bookwriter.makeCleaner(['(1/2)', '(2/2)', '(本章未完,请翻页)'])
 
 
-def addBook(book_link, book_name):
-    if book_link in books:
-        return None
-    books[book_link] = book_name
-
-
-def findBooks(url, lv):
+def parseBooks(url, res):
     """
-    寻找小说
+    解析查找小说时抓到的页面
 
-    :param url:链接
-    :param lv:查找深度
-    :return:
+    :param url: 页面链接
+    :param res: requests.Response
+    :return: (小说列表 [(小说链接, 书名)], 需要继续查找的链接列表)
     """
 
-    res = requests.get(url, headers=headers)
-    if res.status_code != requests.codes.ok:
-        return None
-    res.encoding = res.apparent_encoding
-    beautifulSoup = BeautifulSoup(res.text, 'html.parser')
-    bookElems = beautifulSoup.select('a')
-    for elem in bookElems:
+    document = htmlextract.parse(httpclient.text(res), ['a'])
+    found = []
+    links = []
+    for elem in document.select('a'):
         newLink = elem.get('href')
-        name = elem.getText()
-        if newLink in ignoreLink:
+        name = elem.text()
+        if newLink is None or newLink in ignoreLink:
             continue
         if name == '':
             continue
         mo = bookRegex.search(newLink)
         if mo:
-            addBook(mo.group(1) + '/', name)
-        elif lv < level:
-            findBooks(base_link + newLink, lv + 1)
+            found.append((mo.group(1) + '/', name))
+        else:
+            links.append(newLink)
+    return found, links
 
 
-def getChapters():
+async def findBooks(url, out, concurrency, rate, max_pages=None, bloom=0):
+    """
+    寻找小说
+    广度优先并发抓取，每个页面只抓一次，每本小说只输出一次
+
+    :param url: 起始链接
+    :param out: 目录文件，每行一个 {"link": 小说链接, "name": 书名}
+    :param concurrency: 同时进行的请求数
+    :param rate: 每秒最多请求数
+    :param max_pages: 最多抓取的页面数
+    :param bloom: 大于 0 时页面链接用按此容量创建的布隆过滤器去重，否则用 set
+    :return: Crawler
+    """
+
+    # 小说数量不多，始终精确去重，布隆过滤器误判会丢书
+    seenBooks = VisitedSet()
+
+    def addBook(book):
+        book_link, book_name = book
+        if seenBooks.add(book_link):
+            out.write(json.dumps({'link': book_link, 'name': book_name},
+                                 ensure_ascii=False) + '\n')
+            out.flush()
+
+    visited = BloomFilter(bloom) if bloom > 0 else VisitedSet()
+    fetcher = AsyncFetcher(concurrency, rate, headers)
+    crawler = Crawler(fetcher, parseBooks, addBook, max_depth=level,
+                      max_pages=max_pages, visited=visited)
+    try:
+        await crawler.crawl([url])
+    finally:
+        fetcher.close()
+    return crawler
+
+
+def getChapters(journal=None):
     """
     获取章节链接列表
     本来可以一直使用下一章，但是缺章会中断后续，所以改用章节列表，跳过出错章节
+    有抓取日志时发送条件请求，目录没有变化就使用日志中保存的目录
 
-    :return:
+    :param journal: CrawlJournal
+    :return: 目录是否有变化
     """
 
-    res = requests.get(base_link + book_code + 'all.html', headers=headers)
+    url = base_link + book_code + 'all.html'
+    requestHeaders = headers
+    if journal is not None:
+        requestHeaders = httpclient.conditionalHeaders(
+            headers, *journal.validators(url))
+    res = httpclient.get(url, headers=requestHeaders)
+    if res.status_code == requests.codes.not_modified:
+        chapters.extend(journal.chapterIndex(book_code))
+        return False
+
     res.raise_for_status()
-    res.encoding = res.apparent_encoding
-    beautifulSoup = BeautifulSoup(res.text, 'html.parser')
-    chapterElems = beautifulSoup.select('dd')
+    document = htmlextract.parse(httpclient.text(res), ['dd'])
+    chapterElems = document.select('dd')
     for idx in range(1, len(chapterElems)):
         chapters.append(chapterElems[idx].select('a')[0].get('href'))
+    if journal is not None:
+        journal.saveChapterIndex(book_code, chapters)
+        journal.saveValidators(url, *httpclient.validators(res))
+    return True
+
+
+def parseChapter(text):
+    """
+    解析章节页面
+
+    :param text: 页面 html
+    :return: (章节内容, 下一页链接)，内容未经清理
+    """
+
+    document = htmlextract.parse(text, ['#pb_next', '#chaptercontent'])
+    nextElems = document.select('#pb_next')
+    chapterContentElems = document.select('#chaptercontent')
+    nextPage = nextElems[0].get('href')
+    return chapterContentElems[0].text(), nextPage
 
 
 def getChapter(chapter_link):
@@ -83,29 +154,266 @@ def getChapter(chapter_link):
     下一章节链接不包含'_'则此章节结束，包含则继续抓取下一页
 
     :param chapter_link:
-    :return:
+    :return: (章节内容, 是否完整)
+    """
+
+    parts = []
+    while True:
+        res = httpclient.get(base_link + chapter_link, headers=headers)
+        if res.status_code != requests.codes.ok:
+            return ''.join(parts), False
+
+        content, nextPage = parseChapter(httpclient.text(res))
+        parts.append(content)
+        if '_' not in nextPage:
+            return ''.join(parts), True
+        chapter_link = nextPage
+
+
+async def fetchChapter(fetcher, chapter_link, journal=None):
     """
+    异步抓取一章的所有分页，分页之间只能顺序抓取
+    有抓取日志时跳过已记录的分页，每抓到一页立即记录
 
-    res = requests.get(base_link + chapter_link, headers=headers)
+    :param fetcher: AsyncFetcher
+    :param chapter_link: 章节链接
+    :param journal: CrawlJournal
+    :return: (章节内容, 是否完整)，中途出错时内容只有已抓到的部分
+    """
+
+    chapter = chapter_link
+    parts = []
+    if journal is not None:
+        pages = journal.pages(book_code, chapter)
+        parts = [page[2] for page in pages]
+        if pages:
+            chapter_link = pages[-1][3]
+            if '_' not in chapter_link:
+                journal.completeChapter(book_code, chapter)
+                return ''.join(parts), True
+
+    while True:
+        res = await fetcher.get(base_link + chapter_link)
+        if res.status_code != requests.codes.ok:
+            return ''.join(parts), False
+        content, nextPage = parseChapter(httpclient.text(res))
+        parts.append(content)
+        if journal is not None:
+            journal.savePage(book_code, chapter, len(parts), chapter_link,
+                             content, nextPage)
+            journal.saveValidators(base_link + chapter_link,
+                                   *httpclient.validators(res))
+        if '_' not in nextPage:
+            if journal is not None:
+                journal.completeChapter(book_code, chapter)
+            return ''.join(parts), True
+        chapter_link = nextPage
+
+
+async def downloadChapters(concurrency, rate, journal=None, writer=None):
+    """
+    并发抓取 chapters 中的所有章节
+    没有抓取日志时按章节列表顺序交给 writer，有日志时只抓未完成的章节
+
+    :param concurrency: 同时进行的请求数
+    :param rate: 每秒最多请求数
+    :param journal: CrawlJournal
+    :param writer: bookwriter.BookWriter
+    """
+
+    todo = chapters
+    if journal is not None:
+        completed = journal.completedChapters(book_code)
+        todo = [chapter for chapter in chapters if chapter not in completed]
+        print('%d/%d 章已完成' % (len(chapters) - len(todo), len(chapters)))
+
+    fetcher = AsyncFetcher(concurrency, rate, headers)
+    try:
+        async for content, complete in orderedResults(
+                (fetchChapter(fetcher, chapter, journal) for chapter in todo),
+                concurrency * 4):
+            if journal is None:
+                writer.writeChapter(content, complete=complete)
+    finally:
+        fetcher.close()
+
+
+async def recheckChapter(fetcher, journal, chapter):
+    """
+    用条件请求检查已完成章节的第一页，有变化时删除记录以便重新抓取
+
+    :param fetcher: AsyncFetcher
+    :param journal: CrawlJournal
+    :param chapter: 章节链接
+    :return: 章节是否有变化
+    """
+
+    pages = journal.pages(book_code, chapter)
+    if not pages:
+        return False
+    _, pageLink, oldContent, oldNext = pages[0]
+    url = base_link + pageLink
+    res = await fetcher.get(url, headers=httpclient.conditionalHeaders(
+        headers, *journal.validators(url)))
     if res.status_code != requests.codes.ok:
-        return None
+        return False
+    if parseChapter(httpclient.text(res)) == (oldContent, oldNext):
+        journal.saveValidators(url, *httpclient.validators(res))
+        return False
+    journal.resetChapter(book_code, chapter)
+    return True
 
-    res.encoding = res.apparent_encoding
-    beautifulSoup = BeautifulSoup(res.text, 'html.parser')
-    nextElems = beautifulSoup.select('#pb_next')
-    chapterContentElems = beautifulSoup.select('#chaptercontent')
-    nextPage = nextElems[0].get('href')
-    content = chapterContentElems[0].getText()
-    ctx = content.replace(r'(1/2)', '').replace(r'(2/2)', '').replace(
-        r'(本章未完,请翻页)', '')
-    textFile.write(
-        ("".join([s for s in ctx.splitlines(True) if s.strip()])))
-    if '_' not in nextPage:
-        textFile.write('\n')
-    else:
-        getChapter(nextPage)
-
-
-getChapters()
-for chapter in chapters:
-    getChapter(chapter)
+
+async def updateChapters(concurrency, rate, journal, recheck):
+    """
+    增量更新: 先检查最后 recheck 个已完成的章节，再抓取新增和有变化的章节
+
+    :param concurrency: 同时进行的请求数
+    :param rate: 每秒最多请求数
+    :param journal: CrawlJournal
+    :param recheck: 重新检查的章节数
+    :return: 有变化的章节数
+    """
+
+    completed = journal.completedChapters(book_code)
+    done = [chapter for chapter in chapters if chapter in completed]
+    changed = 0
+    if recheck > 0 and done:
+        fetcher = AsyncFetcher(concurrency, rate, headers)
+        try:
+            results = await asyncio.gather(
+                *[recheckChapter(fetcher, journal, chapter)
+                  for chapter in done[-recheck:]])
+        finally:
+            fetcher.close()
+        changed = sum(results)
+        if changed:
+            print('%d 章有变化' % changed)
+    await downloadChapters(concurrency, rate, journal)
+    return changed
+
+
+def openOutput(path, format, append=False):
+    """
+    :param path: 输出文件
+    :param format: 输出格式，None 表示按扩展名推断
+    :param append: 追加到已有输出
+    :return: bookwriter.BookWriter
+    """
+
+    return bookwriter.openWriter(path, format, '\n', cleanChapter, append)
+
+
+def updateOutput(journal, path, format, completed, changed):
+    """
+    增量模式的输出，文件中只保留从头开始连续完成的章节
+    上次的输出正好是已完成章节的开头部分并且没有章节变化时只追加新章节，否则重写
+
+    :param journal: CrawlJournal
+    :param path: 输出文件
+    :param format: 输出格式
+    :param completed: 本次抓取前已完成的章节
+    :param changed: 有变化的章节数
+    :return: 未写入的章节数
+    """
+
+    prefix = 0
+    while prefix < len(chapters) and chapters[prefix] in completed:
+        prefix += 1
+    appendable = (format or bookwriter.formatOf(path)) in \
+        bookwriter.appendableFormats
+    if (appendable and not changed and prefix == len(completed)
+            and os.path.exists(path)):
+        with openOutput(path, format, True) as writer:
+            missing = journal.rebuild(book_code, chapters[prefix:], writer,
+                                      False)
+        print('追加 %d 章' % (len(chapters) - prefix - missing))
+        return missing
+
+    with openOutput(path, format) as writer:
+        return journal.rebuild(book_code, chapters, writer, False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='笔趣阁小说抓取')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='同时进行的请求数，1 为逐章顺序抓取')
+    parser.add_argument('-r', '--rate', type=float, default=5,
+                        help='每秒最多请求数，0 表示不限')
+    parser.add_argument('-o', '--output', default=output_path,
+                        help='输出文件，chapters 格式为目录')
+    parser.add_argument('-f', '--format', choices=bookwriter.formats,
+                        default=None, help='输出格式，默认按扩展名推断')
+    parser.add_argument('-j', '--journal', default=None,
+                        help='抓取日志，默认为 输出文件.journal')
+    parser.add_argument('--no-journal', action='store_true',
+                        help='不记录抓取日志，每次从头抓取')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='增量更新，只抓新增或有变化的章节并追加到输出文件')
+    parser.add_argument('--recheck', type=int, default=1,
+                        help='增量更新时重新检查最后几个已完成的章节')
+    parser.add_argument('--find-books', nargs='?', const=base_link + '/',
+                        metavar='URL', help='从指定页面(默认首页)开始查找小说')
+    parser.add_argument('--catalog', default=catalog_path,
+                        help='查找小说时输出的目录文件')
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help='查找小说时最多抓取的页面数')
+    parser.add_argument('--bloom', type=int, default=0, metavar='CAPACITY',
+                        help='查找小说时页面链接用布隆过滤器去重，参数为预计页面数')
+    args = parser.parse_args(argv)
+    if args.incremental and args.no_journal:
+        parser.error('--incremental 需要抓取日志')
+
+    try:
+        if args.find_books:
+            with open(args.catalog, 'w', encoding='utf-8') as out:
+                crawler = asyncio.run(findBooks(
+                    args.find_books, out, max(args.concurrency, 1), args.rate,
+                    args.max_pages, args.bloom))
+            print(crawler.summary())
+            return
+
+        if args.no_journal:
+            getChapters()
+            with openOutput(args.output, args.format) as writer:
+                if args.concurrency <= 1:
+                    for chapter in chapters:
+                        content, complete = getChapter(chapter)
+                        writer.writeChapter(content, complete=complete)
+                else:
+                    asyncio.run(downloadChapters(args.concurrency, args.rate,
+                                                 writer=writer))
+            return
+
+        journal = CrawlJournal(args.journal or args.output + '.journal')
+        try:
+            if not getChapters(journal):
+                print('目录没有变化')
+            concurrency = max(args.concurrency, 1)
+            if args.incremental:
+                completed = journal.completedChapters(book_code)
+                changed = 0
+                try:
+                    changed = asyncio.run(updateChapters(
+                        concurrency, args.rate, journal, args.recheck))
+                finally:
+                    missing = updateOutput(journal, args.output, args.format,
+                                           completed, changed)
+            else:
+                try:
+                    asyncio.run(downloadChapters(concurrency, args.rate,
+                                                 journal))
+                finally:
+                    # 中断时也把已抓到的部分写出来
+                    with openOutput(args.output, args.format) as writer:
+                        missing = journal.rebuild(book_code, chapters, writer)
+        finally:
+            journal.close()
+        if missing:
+            print('%d 章未完成，重新运行可继续抓取' % missing)
+    finally:
+        print(httpclient.summary())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
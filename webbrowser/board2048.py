@@ -0,0 +1,350 @@
+#! python3
+#
+# 2048 位棋盘引擎
+# 整个 4x4 棋盘打包成一个 64 位整数，每格 4 位保存指数(0 为空, 1 为 2, 11 为 2048)
+# 第 y 行位于 16 * y 位开始的 16 位，行内第 x 格位于 4 * x 位
+# 行移动结果预先计算成查找表，上下移动通过转置复用行表
+#
+
+import math
+
+maximum = 4
+rowMask = 0xFFFF
+rowCount = 1 << 16
+wonRank = 11  # 2048
+
+# 行移动查找表，保存 原行 ^ 移动后行，便于直接异或回棋盘
+rowLeftTable = [0] * rowCount
+rowRightTable = [0] * rowCount
+# 列移动查找表，转置后的行结果展开回列的位置
+colUpTable = [0] * rowCount
+colDownTable = [0] * rowCount
+
+
+def unpackRow(row):
+    """
+    16 位行拆成 4 个指数
+    """
+    return [(row >> 0) & 0xF, (row >> 4) & 0xF, (row >> 8) & 0xF,
+            (row >> 12) & 0xF]
+
+
+def packRow(ranks):
+    return ranks[0] | (ranks[1] << 4) | (ranks[2] << 8) | (ranks[3] << 12)
+
+
+def reverseRow(row):
+    return ((row >> 12) | ((row >> 4) & 0x00F0) | ((row << 4) & 0x0F00)
+            | ((row << 12) & 0xF000))
+
+
+def unpackCol(row):
+    """
+    把 16 位行展开成一列(每格间隔 16 位)
+    """
+    return ((row & 0x000F) | ((row & 0x00F0) << 12) | ((row & 0x0F00) << 24)
+            | ((row & 0xF000) << 36))
+
+
+def transpose(board):
+    """
+    转置棋盘，行列互换
+    """
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def slideRow(ranks):
+    """
+    向下标 0 方向移动一行，同一次移动中合并产生的格子不会再合并
+
+    :param ranks: 4 个指数
+    :return: 移动后的 4 个指数
+    """
+    line = [r for r in ranks if r]
+    ret = []
+    idx = 0
+    while idx < len(line):
+        rank = line[idx]
+        if idx + 1 < len(line) and line[idx + 1] == rank and rank != 0xF:
+            ret.append(rank + 1)
+            idx += 2
+        else:
+            ret.append(rank)
+            idx += 1
+    return ret + [0] * (maximum - len(ret))
+
+
+def buildTables():
+    """
+    预先计算所有 65536 种行的移动结果
+    """
+    for row in range(rowCount):
+        result = packRow(slideRow(unpackRow(row)))
+        revRow = reverseRow(row)
+        revResult = reverseRow(result)
+
+        rowLeftTable[row] = row ^ result
+        rowRightTable[revRow] = revRow ^ revResult
+        colUpTable[row] = unpackCol(row) ^ unpackCol(result)
+        colDownTable[revRow] = unpackCol(revRow) ^ unpackCol(revResult)
+
+
+def moveUp(board):
+    ret = board
+    t = transpose(board)
+    ret ^= colUpTable[t & rowMask]
+    ret ^= colUpTable[(t >> 16) & rowMask] << 4
+    ret ^= colUpTable[(t >> 32) & rowMask] << 8
+    ret ^= colUpTable[(t >> 48) & rowMask] << 12
+    return ret
+
+
+def moveDown(board):
+    ret = board
+    t = transpose(board)
+    ret ^= colDownTable[t & rowMask]
+    ret ^= colDownTable[(t >> 16) & rowMask] << 4
+    ret ^= colDownTable[(t >> 32) & rowMask] << 8
+    ret ^= colDownTable[(t >> 48) & rowMask] << 12
+    return ret
+
+
+def moveLeft(board):
+    ret = board
+    ret ^= rowLeftTable[board & rowMask]
+    ret ^= rowLeftTable[(board >> 16) & rowMask] << 16
+    ret ^= rowLeftTable[(board >> 32) & rowMask] << 32
+    ret ^= rowLeftTable[(board >> 48) & rowMask] << 48
+    return ret
+
+
+def moveRight(board):
+    ret = board
+    ret ^= rowRightTable[board & rowMask]
+    ret ^= rowRightTable[(board >> 16) & rowMask] << 16
+    ret ^= rowRightTable[(board >> 32) & rowMask] << 32
+    ret ^= rowRightTable[(board >> 48) & rowMask] << 48
+    return ret
+
+
+# 与 play2048 的 actions 顺序一致: 0 up, 1 right, 2 down, 3 left
+moveFunctions = [moveUp, moveRight, moveDown, moveLeft]
+
+
+def moveBoard(board, direction):
+    return moveFunctions[direction](board)
+
+
+def countEmpty(board):
+    """
+    统计空格数量
+    """
+    x = board
+    x |= (x >> 2) & 0x3333333333333333
+    x |= x >> 1
+    return bin(~x & 0x1111111111111111).count('1')
+
+
+def maxRank(board):
+    ret = 0
+    while board:
+        rank = board & 0xF
+        if rank > ret:
+            ret = rank
+        board >>= 4
+    return ret
+
+
+def lineSmoothness(ranks):
+    """
+    相邻(跳过空格)两个图块指数差值之和的相反数
+    """
+    smoothness = 0
+    previous = 0
+    for rank in ranks:
+        if rank:
+            if previous:
+                smoothness -= abs(previous - rank)
+            previous = rank
+    return smoothness
+
+
+def lineMonotonicity(ranks):
+    """
+    单行的单调性
+
+    :param ranks: 4 个指数
+    :return: (递减方向累计, 递增方向累计)
+    """
+    totals = [0, 0]
+    _current = 0
+    _next = _current + 1
+    while _next < maximum:
+        while _next < maximum and not ranks[_next]:
+            _next = _next + 1
+
+        if _next >= maximum:
+            _next = _next - 1
+
+        _currentValue = ranks[_current]
+        _nextValue = ranks[_next]
+        if _currentValue > _nextValue:
+            totals[0] = totals[0] + (_nextValue - _currentValue)
+        elif _nextValue > _currentValue:
+            totals[1] = totals[1] + (_currentValue - _nextValue)
+
+        _current = _next
+        _next = _next + 1
+    return totals
+
+
+def boardRows(board):
+    return [(board >> (16 * y)) & rowMask for y in range(maximum)]
+
+
+def smoothness(board):
+    """
+    行方向(向右)与列方向(向下)的平滑度之和
+    """
+    total = 0
+    for row in boardRows(board) + boardRows(transpose(board)):
+        total += lineSmoothness(unpackRow(row))
+    return total
+
+
+def monotonicity2(board):
+    """
+    measures how monotonic the grid is. This means the values of the tiles
+    are strictly increasing
+    or decreasing in both the left/right and up/down directions
+    """
+    ret = 0
+    for rows in [boardRows(board), boardRows(transpose(board))]:
+        totals = [0, 0]
+        for row in rows:
+            dec, inc = lineMonotonicity(unpackRow(row))
+            totals[0] += dec
+            totals[1] += inc
+        ret += max(totals)
+    return ret
+
+
+def evaluate(board, smoothWeight=0.1, mono2Weight=1.0, emptyWeight=2.7,
+             maxWeight=1.0):
+    """
+    静态评估
+    """
+
+    emptyCells = countEmpty(board)
+    return (smoothness(board) * smoothWeight
+            + monotonicity2(board) * mono2Weight
+            + math.log(max(emptyCells, 1)) * emptyWeight
+            + maxRank(board) * maxWeight)
+
+
+class Grid:
+    """
+    格子，内部使用位棋盘
+    """
+
+    def __init__(self, board=0):
+        self.board = board
+
+    def initial(self, regex_list):
+        """
+        通过web初始化数据
+
+        :param regex_list: [(值, x, y), ...] x y 从 1 开始
+        :return:
+        """
+        for tupleElem in regex_list:
+            rank = int(tupleElem[0]).bit_length() - 1
+            x = int(tupleElem[1]) - 1
+            y = int(tupleElem[2]) - 1
+            if self.cellRank(x, y) < rank:
+                self.setCellRank(x, y, rank)
+
+    @staticmethod
+    def fromValues(values):
+        """
+        通过按行排列的 16 个格子值初始化
+
+        :param values: [值, ...] 第 y 行第 x 格下标为 4 * y + x，0 为空
+        :return: Grid
+        """
+        board = 0
+        for idx, value in enumerate(values):
+            if value:
+                board |= (int(value).bit_length() - 1) << (4 * idx)
+        return Grid(board)
+
+    def clone(self):
+        return Grid(self.board)
+
+    def cellRank(self, x, y):
+        return (self.board >> (4 * (maximum * y + x))) & 0xF
+
+    def setCellRank(self, x, y, rank):
+        shift = 4 * (maximum * y + x)
+        self.board = (self.board & ~(0xF << shift)) | (rank << shift)
+
+    def cellValue(self, x, y):
+        rank = self.cellRank(x, y)
+        return 1 << rank if rank else 0
+
+    def availableCells(self):
+        """
+        获取所有可用的单元格
+
+        :return: [(x, y), ...]
+        """
+        cells = []
+        for y in range(maximum):
+            for x in range(maximum):
+                if not self.cellRank(x, y):
+                    cells.append((x, y))
+        return cells
+
+    def move(self, direction):
+        newBoard = moveBoard(self.board, direction)
+        moved = newBoard != self.board
+        won = moved and maxRank(newBoard) >= wonRank > maxRank(self.board)
+        self.board = newBoard
+        return moved, won
+
+    def smoothness(self):
+        return smoothness(self.board)
+
+    def monotonicity2(self):
+        return monotonicity2(self.board)
+
+    def maxValue(self):
+        """
+        获取最大值(指数)
+        """
+        return maxRank(self.board)
+
+    def evaluate(self):
+        return evaluate(self.board)
+
+    def line(self, y):
+        return [self.cellValue(x, y) for x in range(maximum)]
+
+    def display(self):
+        """
+        打印格子信息
+        """
+        for y in range(maximum):
+            print('+----+----+----+----+')
+            print('|%4s|%4s|%4s|%4s|' % tuple(self.line(y)))
+        print('+----+----+----+----+')
+
+
+buildTables()
@@ -0,0 +1,268 @@
+#! python3
+# 书籍输出
+# 抓取程序按章节顺序交给写入器 writeChapter(章节文本)，写入器负责清理和输出
+# 清理: 一次正则替换去掉翻页提示等标记，一次按行过滤去掉空行
+# 输出经过大缓冲区写入，内存占用与书的长度无关
+# 格式: txt、每章一个文件、gzip / zstd 压缩的 txt、EPUB
+#
+
+import os
+import re
+import gzip
+import html
+import time
+import uuid
+import zipfile
+
+bufferSize = 1 << 20  # 1 MiB
+formats = ['txt', 'chapters', 'gzip', 'zstd', 'epub']
+# 可以追加的格式，gzip / zstd 追加时新开一个 member / frame
+appendableFormats = {'txt', 'gzip', 'zstd'}
+
+
+def makeCleaner(markers):
+    """
+    生成章节清理函数: 去掉 markers 中的文字，再去掉只有空白的行
+
+    :param markers: 需要去掉的文字列表
+    :return: clean(text) -> text
+    """
+    markerRegex = re.compile('|'.join(re.escape(marker) for marker in markers))
+
+    def clean(text):
+        if markers:
+            text = markerRegex.sub('', text)
+        return ''.join([line for line in text.splitlines(True)
+                        if not line.isspace()])
+    return clean
+
+
+def chapterTitle(text):
+    """
+    :return: 章节的第一个非空行
+    """
+    for line in text.splitlines():
+        if line.strip():
+            return line.strip()
+    return ''
+
+
+def formatOf(path):
+    """
+    根据文件扩展名推断输出格式
+    """
+    extension = os.path.splitext(path)[1].lower()
+    return {'.gz': 'gzip', '.zst': 'zstd', '.epub': 'epub'}.get(extension,
+                                                                'txt')
+
+
+class BookWriter:
+    """
+    写入器基类
+    """
+
+    def __init__(self, separator='\n', clean=None):
+        """
+        :param separator: 每个完整章节后写入的分隔
+        :param clean: 章节清理函数
+        """
+        self.separator = separator
+        self.clean = clean
+        self.chapters = 0
+
+    def writeChapter(self, text, title=None, complete=True):
+        """
+        :param text: 章节文本
+        :param title: 章节标题，默认取第一个非空行
+        :param complete: 章节是否完整，不完整时不写分隔
+        """
+        if self.clean is not None:
+            text = self.clean(text)
+        self.chapters += 1
+        self.writeText(text, title, complete)
+
+    def writeText(self, text, title, complete):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TextWriter(BookWriter):
+    """
+    整本书写入一个文本文件，可以压缩
+    """
+
+    def __init__(self, path, separator='\n', clean=None, compress=None,
+                 append=False, encoding=None):
+        """
+        :param path: 输出文件
+        :param compress: None, 'gzip' 或 'zstd'
+        :param append: 追加到已有文件末尾
+        :param encoding: 文件编码，默认与 open() 相同
+        """
+        super().__init__(separator, clean)
+        mode = 'a' if append else 'w'
+        if compress is None:
+            self.file = open(path, mode, buffering=bufferSize,
+                             encoding=encoding)
+        elif compress == 'gzip':
+            self.file = gzip.open(path, mode + 't', encoding=encoding)
+        elif compress == 'zstd':
+            import zstandard
+            self.file = zstandard.open(path, mode + 't', encoding=encoding)
+        else:
+            raise ValueError('unknown compression: %s' % compress)
+
+    def writeText(self, text, title, complete):
+        self.file.write(text)
+        if complete:
+            self.file.write(self.separator)
+
+    def close(self):
+        self.file.close()
+
+
+class ChapterFilesWriter(BookWriter):
+    """
+    每章写入目录中的一个文件，文件名为 序号 + 标题
+    """
+
+    def __init__(self, directory, separator='\n', clean=None, start=1,
+                 encoding=None):
+        """
+        :param directory: 输出目录
+        :param start: 第一个文件的序号
+        """
+        super().__init__(separator, clean)
+        self.directory = directory
+        self.index = start
+        self.encoding = encoding
+        os.makedirs(directory, exist_ok=True)
+
+    def writeText(self, text, title, complete):
+        title = re.sub(r'[\\/:*?"<>|\s]+', ' ',
+                       title or chapterTitle(text)).strip()
+        name = '%04d %s.txt' % (self.index, title) if title else (
+            '%04d.txt' % self.index)
+        with open(os.path.join(self.directory, name), 'w',
+                  buffering=bufferSize, encoding=self.encoding) as chapterFile:
+            chapterFile.write(text)
+            if complete:
+                chapterFile.write(self.separator)
+        self.index += 1
+
+
+class EpubWriter(BookWriter):
+    """
+    EPUB 3，章节边抓边写入 zip，结束时写目录和 content.opf
+    """
+
+    def __init__(self, path, book_title=None, clean=None, language='zh'):
+        """
+        :param path: 输出文件
+        :param book_title: 书名，默认取文件名
+        :param language: 语言
+        """
+        super().__init__('', clean)
+        self.bookTitle = book_title or os.path.splitext(
+            os.path.basename(path))[0]
+        self.language = language
+        self.titles = []
+        self.zip = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        # mimetype 必须是第一个文件并且不压缩
+        self.zip.writestr('mimetype', 'application/epub+zip',
+                          zipfile.ZIP_STORED)
+        self.zip.writestr(
+            'META-INF/container.xml',
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container version="1.0" '
+            'xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" '
+            'media-type="application/oebps-package+xml"/></rootfiles>\n'
+            '</container>\n')
+
+    def writeText(self, text, title, complete):
+        title = title or chapterTitle(text) or str(len(self.titles) + 1)
+        self.titles.append(title)
+        name = 'OEBPS/c%05d.xhtml' % len(self.titles)
+        with self.zip.open(name, 'w') as chapterFile:
+            chapterFile.write((
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml" lang="%s">\n'
+                '<head><title>%s</title></head>\n<body>\n<h2>%s</h2>\n' % (
+                    self.language, html.escape(title),
+                    html.escape(title))).encode('utf-8'))
+            for line in text.splitlines():
+                if line.strip() and line.strip() != title:
+                    chapterFile.write(('<p>%s</p>\n' % html.escape(
+                        line.strip())).encode('utf-8'))
+            chapterFile.write(b'</body>\n</html>\n')
+
+    def close(self):
+        items = []
+        spine = []
+        navPoints = []
+        for idx, title in enumerate(self.titles, 1):
+            items.append('<item id="c%05d" href="c%05d.xhtml" '
+                         'media-type="application/xhtml+xml"/>' % (idx, idx))
+            spine.append('<itemref idref="c%05d"/>' % idx)
+            navPoints.append('<li><a href="c%05d.xhtml">%s</a></li>' % (
+                idx, html.escape(title)))
+        self.zip.writestr(
+            'OEBPS/nav.xhtml',
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" '
+            'xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            '<head><title>%s</title></head>\n<body>\n'
+            '<nav epub:type="toc"><ol>\n%s\n</ol></nav>\n'
+            '</body>\n</html>\n' % (
+                html.escape(self.bookTitle), '\n'.join(navPoints)))
+        self.zip.writestr(
+            'OEBPS/content.opf',
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" '
+            'unique-identifier="id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            '<dc:identifier id="id">urn:uuid:%s</dc:identifier>\n'
+            '<dc:title>%s</dc:title>\n<dc:language>%s</dc:language>\n'
+            '<meta property="dcterms:modified">%s</meta>\n'
+            '</metadata>\n<manifest>\n'
+            '<item id="nav" href="nav.xhtml" '
+            'media-type="application/xhtml+xml" properties="nav"/>\n'
+            '%s\n</manifest>\n<spine>\n%s\n</spine>\n</package>\n' % (
+                uuid.uuid4(), html.escape(self.bookTitle), self.language,
+                time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                '\n'.join(items), '\n'.join(spine)))
+        self.zip.close()
+
+
+def openWriter(path, format=None, separator='\n', clean=None, append=False):
+    """
+    按格式创建写入器
+
+    :param path: 输出文件，chapters 格式为目录
+    :param format: formats 之一，默认按扩展名推断
+    :param separator: 每个完整章节后写入的分隔
+    :param clean: 章节清理函数
+    :param append: 追加到已有输出，只有 appendableFormats 支持
+    :return: BookWriter
+    """
+    format = format or formatOf(path)
+    if append and format not in appendableFormats:
+        raise ValueError('%s output cannot be appended' % format)
+    if format == 'txt':
+        return TextWriter(path, separator, clean, append=append)
+    if format in ('gzip', 'zstd'):
+        return TextWriter(path, separator, clean, format, append)
+    if format == 'chapters':
+        return ChapterFilesWriter(path, separator, clean)
+    if format == 'epub':
+        return EpubWriter(path, clean=clean)
+    raise ValueError('unknown format: %s' % format)
@@ -0,0 +1,349 @@
+#! python3
+# 录制 / 回放抓取到的 HTTP 响应，离线测试和调优爬虫
+# record: 运行爬虫，把每个响应保存到 cassette (SQLite)
+# serve:  本地回放服务器，可以加延迟、抖动和随机错误，模拟真实站点
+# bench:  在回放服务器上按不同并发数运行爬虫，统计页面/秒、字节/秒和内存峰值
+#         回放服务器在子进程中运行，内存峰值另外运行一次统计，不影响测速
+#
+# python cassette.py record book.cassette biqumo -- -c 4
+# python cassette.py serve book.cassette --port 8800 --latency 50
+# python cassette.py bench book.cassette biqumo -c 1,4,8,16 --latency 50
+#
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import importlib
+import multiprocessing
+import threading
+import tracemalloc
+import contextlib
+from urllib.parse import urlsplit, urlunsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import httpclient
+
+schema = '''
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL
+);
+'''
+# 回放时保留的响应头，内容已经解压，不保留 Content-Encoding / Content-Length
+keptHeaders = ['Content-Type', 'ETag', 'Last-Modified', 'Cache-Control']
+
+# 爬虫模块, 站点链接变量, 每次运行前需要清空的模块级列表
+targets = {
+    'biqumo': ('biqumo', 'base_link', ['chapters']),
+    'mobile': ('mobileWebCrawler', 'link', []),
+}
+
+
+def keyOf(url):
+    """
+    回放按路径和查询串匹配，与站点无关
+    """
+    parts = urlsplit(url)
+    return (parts.path or '/') + ('?' + parts.query if parts.query else '')
+
+
+class Cassette:
+    """
+    响应存储，可以在多个线程中使用
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(schema)
+
+    def record(self, url, res):
+        """
+        保存响应，304 不保存，以免覆盖完整的响应
+        """
+        if res.status_code == 304:
+            return
+        headers = {name: res.headers[name] for name in keptHeaders
+                   if name in res.headers}
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                (keyOf(url), url, res.status_code, json.dumps(headers),
+                 res.content))
+
+    def lookup(self, key):
+        """
+        :return: (状态码, 响应头字典, 响应体)，没有录制时返回 None
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT status, headers, body FROM responses WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute(
+                'SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 长连接上的小响应不能等 Nagle + 延迟确认，否则每个请求多出几十毫秒
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency or server.jitter:
+            time.sleep(max(server.latency + server.random.uniform(
+                -server.jitter, server.jitter), 0))
+        if server.random.random() < server.errorRate:
+            self.reply(503, {}, b'injected error')
+            return
+        response = server.cassette.lookup(self.path)
+        if response is None:
+            self.reply(404, {}, b'not recorded')
+            return
+        status, headers, body = response
+        etag = headers.get('ETag')
+        lastModified = headers.get('Last-Modified')
+        if ((etag and self.headers.get('If-None-Match') == etag)
+                or (lastModified and self.headers.get('If-Modified-Since')
+                    == lastModified)):
+            self.reply(304, headers, b'')
+            return
+        self.reply(status, headers, body)
+
+    def reply(self, status, headers, body):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    回放服务器，每个请求一个线程，延迟互不影响
+    """
+
+    daemon_threads = True
+
+    def __init__(self, cassette, port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, seed=None):
+        """
+        :param cassette: Cassette
+        :param port: 端口，0 表示随机
+        :param latency: 每个响应的平均延迟(秒)
+        :param jitter: 延迟在 ±jitter 内均匀抖动(秒)
+        :param error_rate: 返回 503 的比例
+        :param seed: 随机种子
+        """
+        super().__init__(('127.0.0.1', port), ReplayHandler)
+        self.cassette = cassette
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = error_rate
+        self.random = random.Random(seed)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def loadTarget(name):
+    """
+    :return: (爬虫模块, 站点链接变量名, 需要清空的列表名)
+    """
+    moduleName, attr, lists = targets[name]
+    return importlib.import_module(moduleName), attr, lists
+
+
+def redirect(module, attr, origin):
+    """
+    把爬虫的站点链接改到回放服务器，保留路径和查询串
+    """
+    parts = urlsplit(getattr(module, attr))
+    server = urlsplit(origin)
+    setattr(module, attr, urlunsplit((server.scheme, server.netloc)
+                                     + tuple(parts[2:])))
+
+
+def record(path, target, argv):
+    """
+    运行爬虫并录制所有响应
+    """
+    cassette = Cassette(path)
+    module = loadTarget(target)[0]
+    hook = cassette.record
+    httpclient.client.hooks.append(hook)
+    try:
+        return module.main(argv)
+    finally:
+        httpclient.client.hooks.remove(hook)
+        print('%d responses in %s' % (len(cassette), path))
+        cassette.close()
+
+
+def runOnce(module, lists, argv, trace=False):
+    """
+    运行一次爬虫
+    tracemalloc 会让爬虫慢好几倍，测速时关闭，内存峰值单独运行一次统计
+
+    :param trace: 是否用 tracemalloc 统计内存峰值
+    :return: (耗时, 请求数, 字节数, 错误数, 内存峰值，不统计时为 None)
+    """
+    for name in lists:
+        del getattr(module, name)[:]
+    httpclient.timings.reset()
+    peak = None
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module.main(argv)
+    finally:
+        elapsed = time.perf_counter() - start
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    stats = httpclient.stats().values()
+    return (elapsed, sum(s['requests'] for s in stats),
+            sum(s['bytes'] for s in stats), sum(s['errors'] for s in stats),
+            peak)
+
+
+def serveProcess(path, options, queue):
+    """
+    在子进程中运行回放服务器，服务器线程不和爬虫争 GIL，也不计入爬虫的内存
+    """
+    cassette = Cassette(path)
+    server = ReplayServer(cassette, **options)
+    queue.put(server.url)
+    server.serve_forever()
+
+
+def bench(path, target, concurrencies, repeat, server_options, argv):
+    """
+    在回放服务器上按不同并发数运行爬虫
+    并发数 1 使用爬虫的逐页顺序抓取
+    """
+    cassette = Cassette(path)
+    recorded = len(cassette)
+    cassette.close()
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(
+        target=serveProcess, args=(path, server_options, queue), daemon=True)
+    server.start()
+    module, attr, lists = loadTarget(target)
+    redirect(module, attr, queue.get())
+    print('%d recorded responses, latency %.0f ms, error rate %.1f%%' % (
+        recorded, server_options['latency'] * 1000,
+        server_options['error_rate'] * 100))
+    print('%-6s %8s %8s %10s %10s %6s %10s' % (
+        'conc', 'time(s)', 'pages', 'pages/s', 'KiB/s', 'errs', 'peak(MiB)'))
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.txt')
+            for concurrency in concurrencies:
+                crawlArgv = ['--no-journal', '-c', str(concurrency),
+                             '-r', '0', '-o', output] + argv
+                peak = runOnce(module, lists, crawlArgv, trace=True)[4]
+                for _ in range(repeat):
+                    elapsed, pages, size, errors, _ = runOnce(
+                        module, lists, crawlArgv)
+                    print('%-6d %8.2f %8d %10.1f %10.1f %6d %10.1f' % (
+                        concurrency, elapsed, pages, pages / elapsed,
+                        size / 1024 / elapsed, errors, peak / 1024 / 1024))
+    finally:
+        server.terminate()
+        server.join()
+
+
+def serverOptions(args):
+    return {'latency': args.latency / 1000, 'jitter': args.jitter / 1000,
+            'error_rate': args.error_rate, 'seed': args.seed}
+
+
+def main(argv=None):
+    # -- 之后的参数原样传给爬虫
+    argv = sys.argv[1:] if argv is None else list(argv)
+    extra = []
+    if '--' in argv:
+        extra = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+
+    parser = argparse.ArgumentParser(description='HTTP 录制回放与爬虫测速',
+                                     epilog='-- 之后的参数传给爬虫')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recordParser = commands.add_parser('record', help='运行爬虫并录制响应')
+    recordParser.add_argument('cassette')
+    recordParser.add_argument('target', choices=sorted(targets))
+
+    serveParser = commands.add_parser('serve', help='启动回放服务器')
+    serveParser.add_argument('cassette')
+    serveParser.add_argument('--port', type=int, default=8800)
+
+    benchParser = commands.add_parser('bench', help='在回放服务器上测速')
+    benchParser.add_argument('cassette')
+    benchParser.add_argument('target', choices=sorted(targets))
+    benchParser.add_argument('-c', '--concurrency', default='1,4,8,16',
+                             help='逗号分隔的并发数')
+    benchParser.add_argument('-n', '--repeat', type=int, default=1,
+                             help='每个并发数运行的次数')
+
+    for subParser in (serveParser, benchParser):
+        subParser.add_argument('--latency', type=float, default=0,
+                               help='平均延迟(毫秒)')
+        subParser.add_argument('--jitter', type=float, default=0,
+                               help='延迟抖动(毫秒)')
+        subParser.add_argument('--error-rate', type=float, default=0,
+                               help='返回 503 的比例')
+        subParser.add_argument('--seed', type=int, default=None,
+                               help='随机种子')
+    args = parser.parse_args(argv)
+
+    if args.command == 'record':
+        return record(args.cassette, args.target, extra)
+    if args.command == 'serve':
+        cassette = Cassette(args.cassette)
+        server = ReplayServer(cassette, args.port, **serverOptions(args))
+        print('replaying %d responses on %s' % (len(cassette), server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        return 0
+    bench(args.cassette, args.target,
+          [int(value) for value in args.concurrency.split(',')], args.repeat,
+          serverOptions(args), extra)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
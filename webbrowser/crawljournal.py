@@ -0,0 +1,181 @@
+#! python3
+# 抓取日志
+# 用 SQLite 记录已经抓到的每一页内容，程序中断或出错后重新运行只抓缺少的部分，
+# 最后按章节顺序从日志重建整本书
+# 每页保存的是提取出的原始文本，重建时按章节交给 bookwriter 清理和输出
+# 同时保存章节目录和各链接的 ETag / Last-Modified，用于增量更新时发送条件请求
+#
+
+import sqlite3
+
+schema = '''
+CREATE TABLE IF NOT EXISTS pages (
+    book TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    url TEXT,
+    content TEXT NOT NULL,
+    next_url TEXT,
+    PRIMARY KEY (book, chapter, page)
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    book TEXT NOT NULL,
+    chapter TEXT NOT NULL,
+    page_count INTEGER,
+    complete INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (book, chapter)
+);
+CREATE TABLE IF NOT EXISTS chapter_index (
+    book TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    chapter TEXT NOT NULL,
+    PRIMARY KEY (book, position)
+);
+CREATE TABLE IF NOT EXISTS validators (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT
+);
+'''
+
+
+class CrawlJournal:
+    """
+    抓取日志
+    章节用字符串标识(章节链接或编号)，页码从 1 开始
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite 文件路径
+        """
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(schema)
+
+    def pages(self, book, chapter):
+        """
+        :return: [(页码, 链接, 内容, 下一页链接), ...] 按页码排序
+        """
+        return self.db.execute(
+            'SELECT page, url, content, next_url FROM pages '
+            'WHERE book = ? AND chapter = ? ORDER BY page',
+            (book, str(chapter))).fetchall()
+
+    def savePage(self, book, chapter, page, url, content, next_url=None):
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                (book, str(chapter), page, url, content, next_url))
+
+    def pageCount(self, book, chapter):
+        row = self.db.execute(
+            'SELECT page_count FROM chapters WHERE book = ? AND chapter = ?',
+            (book, str(chapter))).fetchone()
+        return row[0] if row else None
+
+    def setPageCount(self, book, chapter, count):
+        with self.db:
+            self.db.execute(
+                'INSERT INTO chapters (book, chapter, page_count) '
+                'VALUES (?, ?, ?) ON CONFLICT (book, chapter) '
+                'DO UPDATE SET page_count = excluded.page_count',
+                (book, str(chapter), count))
+
+    def completeChapter(self, book, chapter):
+        """
+        标记章节所有分页已抓取
+        """
+        with self.db:
+            self.db.execute(
+                'INSERT INTO chapters (book, chapter, complete) '
+                'VALUES (?, ?, 1) ON CONFLICT (book, chapter) '
+                'DO UPDATE SET complete = 1',
+                (book, str(chapter)))
+
+    def resetChapter(self, book, chapter):
+        """
+        删除章节记录，下次重新抓取
+        """
+        with self.db:
+            self.db.execute(
+                'DELETE FROM pages WHERE book = ? AND chapter = ?',
+                (book, str(chapter)))
+            self.db.execute(
+                'DELETE FROM chapters WHERE book = ? AND chapter = ?',
+                (book, str(chapter)))
+
+    def completedChapters(self, book):
+        return {row[0] for row in self.db.execute(
+            'SELECT chapter FROM chapters WHERE book = ? AND complete = 1',
+            (book,))}
+
+    def chapterText(self, book, chapter):
+        """
+        :return: (章节文本, 是否完整)
+        """
+        text = ''.join(row[2] for row in self.pages(book, chapter))
+        row = self.db.execute(
+            'SELECT complete FROM chapters WHERE book = ? AND chapter = ?',
+            (book, str(chapter))).fetchone()
+        return text, bool(row and row[0])
+
+    def rebuild(self, book, chapters, writer, partial=True):
+        """
+        按顺序把章节交给写入器
+
+        :param book: 书籍标识
+        :param chapters: 章节标识列表，决定输出顺序
+        :param writer: bookwriter.BookWriter
+        :param partial: True 时未完成的章节只写已抓到的分页，
+                        False 时遇到未完成的章节就停止，输出中只有完整的章节
+        :return: 未完整写入的章节数
+        """
+        missing = 0
+        for idx, chapter in enumerate(chapters):
+            text, complete = self.chapterText(book, chapter)
+            if not complete and not partial:
+                return len(chapters) - idx
+            writer.writeChapter(text, complete=complete)
+            missing += not complete
+        return missing
+
+    def chapterIndex(self, book):
+        """
+        :return: 上次保存的章节目录
+        """
+        return [row[0] for row in self.db.execute(
+            'SELECT chapter FROM chapter_index WHERE book = ? '
+            'ORDER BY position', (book,))]
+
+    def saveChapterIndex(self, book, chapters):
+        with self.db:
+            self.db.execute('DELETE FROM chapter_index WHERE book = ?',
+                            (book,))
+            self.db.executemany(
+                'INSERT INTO chapter_index VALUES (?, ?, ?)',
+                ((book, position, str(chapter))
+                 for position, chapter in enumerate(chapters)))
+
+    def validators(self, url):
+        """
+        :return: (ETag, Last-Modified)，没有记录时为 (None, None)
+        """
+        row = self.db.execute(
+            'SELECT etag, last_modified FROM validators WHERE url = ?',
+            (url,)).fetchone()
+        return row if row else (None, None)
+
+    def saveValidators(self, url, etag, last_modified):
+        with self.db:
+            if etag is None and last_modified is None:
+                self.db.execute('DELETE FROM validators WHERE url = ?', (url,))
+            else:
+                self.db.execute(
+                    'INSERT OR REPLACE INTO validators VALUES (?, ?, ?)',
+                    (url, etag, last_modified))
+
+    def close(self):
+        self.db.close()
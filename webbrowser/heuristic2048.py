@@ -0,0 +1,174 @@
+#! python3
+#
+# 2048 静态评估查找表
+# 平滑度、单调性、空格数、最大值都可以按行(列)拆开计算，
+# 预先算好全部 65536 种行的结果，评估一个棋盘只需要 4 行 + 4 列共 8 次查表
+# 未加权的原始表缓存到磁盘，权重变化时只需重新加权
+#
+
+import os
+import math
+from array import array
+from board2048 import (rowCount, rowMask, unpackRow, transpose,
+                       lineSmoothness, lineMonotonicity)
+
+cacheVersion = 1
+cachePath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'heuristic2048.cache')
+weightNames = ['smoothWeight', 'mono2Weight', 'emptyWeight', 'maxWeight']
+defaultWeights = {
+    'smoothWeight': 0.1,
+    'mono2Weight': 1.0,
+    'emptyWeight': 2.7,
+    'maxWeight': 1.0,
+}
+
+# 原始表: 平滑度, 递减单调性, 递增单调性, 空格数, 最大指数
+rawTables = None
+
+
+def buildRawTables():
+    smooth = array('b', [0]) * rowCount
+    monoDec = array('b', [0]) * rowCount
+    monoInc = array('b', [0]) * rowCount
+    empty = array('b', [0]) * rowCount
+    maxRank = array('b', [0]) * rowCount
+    for row in range(rowCount):
+        ranks = unpackRow(row)
+        smooth[row] = lineSmoothness(ranks)
+        monoDec[row], monoInc[row] = lineMonotonicity(ranks)
+        empty[row] = ranks.count(0)
+        maxRank[row] = max(ranks)
+    return [smooth, monoDec, monoInc, empty, maxRank]
+
+
+def loadRawTables(path=cachePath):
+    """
+    读取缓存的原始表，缓存不存在或版本不符时重新计算并写入
+
+    :param path: 缓存文件，None 表示不使用缓存
+    :return: 原始表
+    """
+    global rawTables
+    if rawTables is not None:
+        return rawTables
+
+    if path is not None and os.path.exists(path):
+        try:
+            with open(path, 'rb') as cacheFile:
+                header = array('i')
+                header.fromfile(cacheFile, 2)
+                if list(header) == [cacheVersion, rowCount]:
+                    tables = []
+                    for _ in range(5):
+                        table = array('b')
+                        table.fromfile(cacheFile, rowCount)
+                        tables.append(table)
+                    rawTables = tables
+                    return rawTables
+        except (OSError, EOFError):
+            pass
+
+    rawTables = buildRawTables()
+    if path is not None:
+        try:
+            with open(path, 'wb') as cacheFile:
+                array('i', [cacheVersion, rowCount]).tofile(cacheFile)
+                for table in rawTables:
+                    table.tofile(cacheFile)
+        except OSError:
+            pass
+    return rawTables
+
+
+class Heuristic:
+    """
+    查表静态评估
+    修改任意权重都会自动重建加权表
+    """
+
+    def __init__(self, smooth_weight=0.1, mono2_weight=1.0, empty_weight=2.7,
+                 max_weight=1.0, cache_path=cachePath):
+        self.raw = loadRawTables(cache_path)
+        self.rowTable = None
+        self.colTable = None
+        self.emptyTable = None
+        self.version = 0  # 每次重建加一，用于判断缓存的搜索结果是否过期
+        self.weights = {
+            'smoothWeight': smooth_weight,
+            'mono2Weight': mono2_weight,
+            'emptyWeight': empty_weight,
+            'maxWeight': max_weight,
+        }
+        self.build()
+
+    def __getattr__(self, name):
+        if name in weightNames:
+            return self.__dict__['weights'][name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name in weightNames:
+            self.setWeights(**{name: value})
+        else:
+            super().__setattr__(name, value)
+
+    def setWeights(self, **weights):
+        """
+        修改权重并重建加权表
+
+        :param weights: smoothWeight / mono2Weight / emptyWeight / maxWeight
+        """
+        for name in weights:
+            if name not in weightNames:
+                raise KeyError(name)
+        self.weights.update(weights)
+        self.build()
+
+    def build(self):
+        smoothWeight = self.weights['smoothWeight']
+        emptyWeight = self.weights['emptyWeight']
+        smooth, monoDec, monoInc, empty, maxRank = self.raw
+
+        # 行: (平滑度, 递减, 递增, 空格数, 最大值)  列: (平滑度, 递减, 递增)
+        # 单调性和最大值不加权，取 max 之后再乘权重，权重为负时结果也与 board2048 一致
+        self.rowTable = [
+            (s * smoothWeight, d, i, e, m)
+            for s, d, i, e, m in zip(smooth, monoDec, monoInc, empty, maxRank)]
+        self.colTable = [
+            (s * smoothWeight, d, i)
+            for s, d, i in zip(smooth, monoDec, monoInc)]
+        # 没有空格时按 1 个计算，避免 log(0)
+        self.emptyTable = [math.log(max(n, 1)) * emptyWeight
+                           for n in range(17)]
+        self.version += 1
+
+    def evaluate(self, board):
+        """
+        静态评估
+
+        :param board: 位棋盘
+        :return: 分数
+        """
+        rowTable = self.rowTable
+        s0, d0, i0, e0, m0 = rowTable[board & rowMask]
+        s1, d1, i1, e1, m1 = rowTable[(board >> 16) & rowMask]
+        s2, d2, i2, e2, m2 = rowTable[(board >> 32) & rowMask]
+        s3, d3, i3, e3, m3 = rowTable[(board >> 48) & rowMask]
+
+        colTable = self.colTable
+        t = transpose(board)
+        s4, d4, i4 = colTable[t & rowMask]
+        s5, d5, i5 = colTable[(t >> 16) & rowMask]
+        s6, d6, i6 = colTable[(t >> 32) & rowMask]
+        s7, d7, i7 = colTable[(t >> 48) & rowMask]
+
+        weights = self.weights
+        return (s0 + s1 + s2 + s3 + s4 + s5 + s6 + s7
+                + (max(d0 + d1 + d2 + d3, i0 + i1 + i2 + i3)
+                   + max(d4 + d5 + d6 + d7, i4 + i5 + i6 + i7))
+                * weights['mono2Weight']
+                + self.emptyTable[e0 + e1 + e2 + e3]
+                + max(m0, m1, m2, m3) * weights['maxWeight'])
+
+    __call__ = evaluate
@@ -0,0 +1,280 @@
+#! python3
+# HTML 提取
+# 爬虫只需要页面中少数几个节点，不必用 html.parser 建完整的 BeautifulSoup 树
+# 依次尝试 selectolax(lexbor)、lxml，都没有安装时退回 BeautifulSoup，
+# 并用 SoupStrainer 只保留目标节点
+# 选择器只支持 'tag'、'#id'、'tag#id' 以及用空格连接的后代选择
+# text() 的结果与 BeautifulSoup 的 getText() 相同: 不含注释和 script / style，
+# 只有空白的文本节点折叠成一个换行或空格
+# 与 HTML 标准的输入预处理一样，解析前 \r\n 和 \r 统一换成 \n，各后端得到相同的文本
+# 后端模块在第一次解析时才导入，只用到 selectolax 时不会加载 bs4
+#
+# 测速: python htmlextract.py 页面文件或目录... [-s 选择器]...
+# 样例页面在 htmlextract_pages 中，章节页和天气页用 \r\n 换行:
+#   python htmlextract.py htmlextract_pages -s '#chaptercontent'
+#       -s '#pb_next' -s 'dd a' -s '#hourTable_0 td'
+#
+
+import os
+import re
+import sys
+import time
+import argparse
+import importlib.util
+
+skipTags = {'script', 'style', 'template'}
+preserveTags = {'pre', 'textarea'}
+asciiSpaces = '\x20\x0a\x09\x0c\x0d'
+partRegex = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*)?(?:#([\w-]+))?$')
+newlineRegex = re.compile(r'\r\n?')
+
+
+def collapse(text, preserve):
+    """
+    与 BeautifulSoup 相同，只有 ASCII 空白的文本折叠成一个换行或空格
+    """
+    if preserve or text.strip(asciiSpaces):
+        return text
+    return '\n' if '\n' in text else ' '
+
+
+def parseSelector(selector):
+    """
+    :param selector: 选择器，例如 '#hourTable_0 tr'
+    :return: [(标签名或 None, id 或 None), ...]
+    """
+    parts = []
+    for part in selector.split():
+        mo = partRegex.match(part)
+        if mo is None or not any(mo.groups()):
+            raise ValueError('unsupported selector: %s' % selector)
+        tag, ident = mo.groups()
+        parts.append((tag.lower() if tag else None, ident))
+    return parts
+
+
+def xpathOf(selector):
+    steps = []
+    for tag, ident in parseSelector(selector):
+        step = tag or '*'
+        if ident:
+            step += '[@id="%s"]' % ident
+        steps.append(step)
+    return './/' + '//'.join(steps)
+
+
+class SelectolaxNode:
+    def __init__(self, node):
+        self.node = node
+
+    def select(self, selector):
+        return [SelectolaxNode(node) for node in self.node.css(selector)]
+
+    def get(self, name, default=None):
+        value = self.node.attributes.get(name, default)
+        return default if value is None else value
+
+    def text(self):
+        parts = []
+        self.collect(self.node, parts, self.node.tag in preserveTags)
+        return ''.join(parts)
+
+    def collect(self, node, parts, preserve):
+        for child in node.iter(include_text=True):
+            tag = child.tag
+            if tag == '-text':
+                parts.append(collapse(child.text_content, preserve))
+            elif tag not in skipTags and not tag.startswith(('_', '!')):
+                self.collect(child, parts, preserve or tag in preserveTags)
+
+
+class LxmlNode:
+    def __init__(self, node):
+        self.node = node
+
+    def select(self, selector):
+        return [LxmlNode(node) for node in self.node.xpath(xpathOf(selector))]
+
+    def get(self, name, default=None):
+        return self.node.get(name, default)
+
+    def text(self):
+        parts = []
+        self.collect(self.node, parts, False)
+        return ''.join(parts)
+
+    def collect(self, node, parts, preserve):
+        tag = node.tag
+        # 注释等节点的 tag 不是字符串，只取其后的 tail
+        if isinstance(tag, str) and tag not in skipTags:
+            inner = preserve or tag in preserveTags
+            if node.text:
+                parts.append(collapse(node.text, inner))
+            for child in node:
+                self.collect(child, parts, inner)
+        if node.tail and node is not self.node:
+            parts.append(collapse(node.tail, preserve))
+
+
+class SoupNode:
+    def __init__(self, node):
+        self.node = node
+
+    def select(self, selector):
+        return [SoupNode(node) for node in self.node.select(selector)]
+
+    def get(self, name, default=None):
+        return self.node.get(name, default)
+
+    def text(self):
+        return self.node.getText()
+
+
+def strainerOf(targets):
+    """
+    根据选择器的第一部分生成 SoupStrainer，只解析目标节点
+    同时有按标签和按 id 的选择器时无法合并，返回 None 解析整个页面
+    """
+    from bs4 import SoupStrainer
+    tags = set()
+    ids = set()
+    for selector in targets:
+        tag, ident = parseSelector(selector)[0]
+        if ident:
+            ids.add(ident)
+        else:
+            tags.add(tag)
+    if ids and not tags:
+        return SoupStrainer(id=sorted(ids))
+    if tags and not ids:
+        return SoupStrainer(sorted(tags))
+    return None
+
+
+def installed(module):
+    """
+    :return: 模块是否可以导入，只查找不导入
+    """
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        return False
+
+
+backends = [name for name, module in (('selectolax', 'selectolax.lexbor'),
+                                      ('lxml', 'lxml.html'))
+            if installed(module)]
+backends.append('html.parser')
+backend = backends[0]
+
+
+def parse(text, targets=(), using=None):
+    """
+    解析页面
+
+    :param text: 页面 html
+    :param targets: 之后会用到的选择器，html.parser 按它们只保留目标节点
+    :param using: 指定后端，默认为可用的最快后端
+    :return: 文档根节点，select / get / text 接口与后端无关
+    """
+    using = using or backend
+    # lexbor 和 libxml2 会自己转换，html.parser 不会
+    if '\r' in text:
+        text = newlineRegex.sub('\n', text)
+    if using == 'selectolax':
+        from selectolax.lexbor import LexborHTMLParser
+        return SelectolaxNode(LexborHTMLParser(text).root)
+    if using == 'lxml':
+        import lxml.html
+        if not text.strip():
+            text = '<html></html>'
+        try:
+            root = lxml.html.document_fromstring(text)
+        except ValueError:
+            # 带 <?xml encoding=...?> 声明的 str 需要先编码
+            root = lxml.html.document_fromstring(
+                text.encode('utf-8'),
+                lxml.html.HTMLParser(encoding='utf-8'))
+        return LxmlNode(root)
+    if using == 'html.parser':
+        from bs4 import BeautifulSoup
+        strainer = strainerOf(targets) if targets else None
+        return SoupNode(BeautifulSoup(text, 'html.parser',
+                                      parse_only=strainer))
+    raise ValueError('unknown backend: %s' % using)
+
+
+def selectFirst(document, selector):
+    """
+    :return: 第一个匹配的节点，没有时返回 None
+    """
+    nodes = document.select(selector)
+    return nodes[0] if nodes else None
+
+
+def extract(document, selector):
+    return [(node.text(), node.get('href'))
+            for node in document.select(selector)]
+
+
+def benchmark(paths, selectors, repeat):
+    """
+    对每个后端统计解析加提取的平均耗时，并检查各后端提取的结果是否一致
+    full soup 是原来不加 SoupStrainer 的 BeautifulSoup 解析，作为对照
+    """
+    pages = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(('.html', '.htm')):
+                    pages.append(os.path.join(path, name))
+        else:
+            pages.append(path)
+    texts = []
+    for path in pages:
+        # 保留原始换行，\r\n 的页面也要检查各后端是否一致
+        with open(path, encoding='utf-8', errors='replace',
+                  newline='') as page:
+            texts.append(page.read())
+    if not texts:
+        print('no pages')
+        return
+
+    total = sum(len(text) for text in texts)
+    print('%d pages, %.1f KiB average' % (len(texts),
+                                          total / len(texts) / 1024))
+    expected = None
+    runs = [(using, using, selectors) for using in backends]
+    runs.append(('full soup', 'html.parser', ()))
+    for name, using, targets in runs:
+        parse(texts[0], targets, using)  # 导入后端模块，不计入耗时
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results = []
+            for text in texts:
+                document = parse(text, targets, using)
+                results.append([extract(document, selector)
+                                for selector in selectors])
+        elapsed = (time.perf_counter() - start) / repeat / len(texts)
+        if expected is None:
+            expected = results
+        same = 'same' if results == expected else 'DIFFERENT'
+        print('%-12s %9.3f ms/page %8.0f pages/s  %s' % (
+            name, elapsed * 1000, 1 / elapsed if elapsed else 0, same))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HTML 提取测速')
+    parser.add_argument('paths', nargs='+', help='保存的页面文件或目录')
+    parser.add_argument('-s', '--select', action='append', default=None,
+                        help='选择器，可多次指定，默认为章节页面的 '
+                             '#chaptercontent 和 #pb_next')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='重复次数')
+    args = parser.parse_args(argv)
+    benchmark(args.paths, args.select or ['#chaptercontent', '#pb_next'],
+              args.repeat)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
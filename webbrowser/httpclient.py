@@ -0,0 +1,359 @@
+#! python3
+# 爬虫共用的 HTTP 客户端
+# 一个 requests.Session 复用连接(keep-alive)，每个站点的连接数有上限，
+# 抓取程序按自己的并发数调用 configure() 扩大上限
+# 5xx、连接失败和读超时自动按指数退避重试
+# gzip / deflate 由 requests 解压，安装了 brotli 时同时接受 br
+# 按站点统计请求耗时: 建立连接(TCP + TLS 握手)、首字节、传输
+# 文本解码: 优先用 HTTP 头或 meta 声明的编码，其次用该站点上次检测到的编码，
+# 解码失败时才做编码检测(apparent_encoding 需要扫描整个响应体)
+#
+# 使用: import httpclient; res = httpclient.get(url, headers=headers)
+#       text = httpclient.text(res)
+#
+
+import re
+import time
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import brotli  # noqa: F401  urllib3 检测到后会自动解压 br
+    acceptEncoding = 'gzip, deflate, br'
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        acceptEncoding = 'gzip, deflate, br'
+    except ImportError:
+        acceptEncoding = 'gzip, deflate'
+
+statusForcelist = (500, 502, 503, 504)
+metaCharsetRegex = re.compile(
+    rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+metaScanBytes = 4096  # meta 声明只在页面开头查找
+
+
+class HostStats:
+    """
+    单个站点的请求统计(秒)
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total = 0.0  # 请求开始到响应体读完
+        self.firstByte = 0.0  # 请求开始到响应头解析完(含握手和重试)
+        self.connects = 0  # 新建连接数
+        self.connectTime = 0.0  # 建立连接耗时
+
+    def asDict(self):
+        requestCount = self.requests or 1
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'bytes': self.bytes,
+            'connects': self.connects,
+            'reused': max(self.requests - self.connects, 0),
+            'meanConnect': (self.connectTime / self.connects
+                            if self.connects else 0.0),
+            'meanFirstByte': self.firstByte / requestCount,
+            'meanTransfer': (self.total - self.firstByte) / requestCount,
+            'meanTotal': self.total / requestCount,
+        }
+
+
+class Timings:
+    """
+    线程安全的按站点统计
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def host(self, host):
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = HostStats()
+        return stats
+
+    def recordConnect(self, host, seconds):
+        with self.lock:
+            stats = self.host(host)
+            stats.connects += 1
+            stats.connectTime += seconds
+
+    def recordRequest(self, host, total, first_byte, size, error=False):
+        with self.lock:
+            stats = self.host(host)
+            stats.requests += 1
+            stats.errors += error
+            stats.bytes += size
+            stats.total += total
+            stats.firstByte += first_byte
+
+    def reset(self):
+        with self.lock:
+            self.hosts = {}
+
+
+timings = Timings()
+
+
+class CharsetCache:
+    """
+    按站点缓存的文本编码，以及编码检测的耗时统计
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}  # 站点 -> 编码
+        self.detections = 0
+        self.detectTime = 0.0
+        self.detectBytes = 0
+        self.skipped = 0  # 没有检测直接解码成功的响应数
+        self.skippedBytes = 0
+
+    @staticmethod
+    def declared(res):
+        """
+        :return: HTTP 头或 meta 声明的编码，没有声明时返回 None
+        """
+        contentType = res.headers.get('Content-Type', '')
+        for param in contentType.split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset' and value.strip(' "\''):
+                return value.strip(' "\'')
+        if 'html' in contentType or not contentType:
+            mo = metaCharsetRegex.search(res.content[:metaScanBytes])
+            if mo:
+                return mo.group(1).decode('ascii')
+        return None
+
+    def decode(self, res):
+        """
+        解码响应体，同时设置 res.encoding
+
+        :param res: requests.Response
+        :return: 文本
+        """
+        content = res.content
+        host = urlsplit(res.url).hostname
+        # UTF-8 的校验很严格，其他编码的文本几乎不可能按 UTF-8 解码成功，
+        # 而 GB18030 之类的编码能解码几乎任何字节，所以先试 UTF-8 再试缓存的编码
+        candidates = [self.declared(res), 'utf-8', self.hosts.get(host)]
+        for encoding in candidates:
+            if not encoding:
+                continue
+            try:
+                text = content.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            res.encoding = encoding
+            with self.lock:
+                if encoding != 'utf-8' or host not in self.hosts:
+                    self.hosts[host] = encoding
+                self.skipped += 1
+                self.skippedBytes += len(content)
+            return text
+
+        start = time.perf_counter()
+        encoding = res.apparent_encoding or 'utf-8'
+        elapsed = time.perf_counter() - start
+        res.encoding = encoding
+        with self.lock:
+            self.hosts[host] = encoding
+            self.detections += 1
+            self.detectTime += elapsed
+            self.detectBytes += len(content)
+        return str(content, encoding, errors='replace')
+
+    def savedTime(self):
+        """
+        :return: 按平均检测速度估算省下的时间(秒)，还没有检测过时返回 None
+        """
+        if not self.detectBytes:
+            return None
+        return self.detectTime / self.detectBytes * self.skippedBytes
+
+    def summary(self):
+        saved = self.savedTime()
+        return ('charset: %d detections %.1f ms, %d skipped, saved %s' % (
+            self.detections, self.detectTime * 1000, self.skipped,
+            'n/a' if saved is None else '~%.1f ms' % (saved * 1000)))
+
+
+charsets = CharsetCache()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        timings.recordConnect(self.host, time.perf_counter() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        timings.recordConnect(self.host, time.perf_counter() - start)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class HttpClient:
+    """
+    连接池化的 HTTP 客户端
+    """
+
+    def __init__(self, max_per_host=8, retries=3, backoff=0.5,
+                 timeout=(5, 30), headers=None):
+        """
+        :param max_per_host: 每个站点最多同时保持的连接数，超过时等待空闲连接
+        :param retries: 最多重试次数
+        :param backoff: 退避系数，第 n 次重试前等待 backoff * 2^(n-1) 秒
+        :param timeout: (连接超时, 读超时) 秒
+        :param headers: 默认请求头
+        """
+        self.timeout = timeout
+        self.retry = Retry(total=retries, connect=retries, read=retries,
+                           status=retries, backoff_factor=backoff,
+                           status_forcelist=statusForcelist,
+                           raise_on_status=False)
+        self.maxPerHost = 0
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        self.configure(max_per_host)
+        self.session.headers['Accept-Encoding'] = acceptEncoding
+        if headers:
+            self.session.headers.update(headers)
+        self.hooks = []  # hook(url, res)，每个响应返回前调用，例如录制
+
+    def configure(self, max_per_host):
+        """
+        保证每个站点至少可以同时使用 max_per_host 个连接，只增不减
+        连接池大小在创建时确定，需要时换一个更大的连接池，
+        正在进行的请求继续使用原来的连接池
+
+        :param max_per_host: 需要的连接数，通常是抓取的并发数
+        """
+        with self.lock:
+            if max_per_host <= self.maxPerHost:
+                return
+            adapter = HTTPAdapter(pool_connections=16,
+                                  pool_maxsize=max_per_host,
+                                  max_retries=self.retry, pool_block=True)
+            adapter.poolmanager.pool_classes_by_scheme = {
+                'http': TimedHTTPConnectionPool,
+                'https': TimedHTTPSConnectionPool,
+            }
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self.maxPerHost = max_per_host
+
+    def get(self, url, **kwargs):
+        """
+        与 requests.get 参数相同，未指定 timeout 时使用默认超时
+
+        :return: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).hostname
+        start = time.perf_counter()
+        try:
+            res = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            timings.recordRequest(host, time.perf_counter() - start,
+                                  time.perf_counter() - start, 0, True)
+            raise
+        total = time.perf_counter() - start
+        timings.recordRequest(host, total,
+                              min(res.elapsed.total_seconds(), total),
+                              len(res.content), res.status_code >= 400)
+        for hook in self.hooks:
+            hook(url, res)
+        return res
+
+    def close(self):
+        self.session.close()
+
+
+client = HttpClient()
+
+
+def get(url, **kwargs):
+    return client.get(url, **kwargs)
+
+
+def configure(max_per_host):
+    client.configure(max_per_host)
+
+
+def text(res):
+    """
+    代替 res.encoding = res.apparent_encoding; res.text
+
+    :param res: requests.Response
+    :return: 解码后的文本
+    """
+    return charsets.decode(res)
+
+
+def validators(res):
+    """
+    :param res: requests.Response
+    :return: (ETag, Last-Modified)
+    """
+    return res.headers.get('ETag'), res.headers.get('Last-Modified')
+
+
+def conditionalHeaders(headers, etag=None, last_modified=None):
+    """
+    在请求头中加入条件请求字段，内容未变时服务器返回 304
+
+    :param headers: 原请求头，不会被修改
+    :param etag: 上次响应的 ETag
+    :param last_modified: 上次响应的 Last-Modified
+    :return: 新的请求头
+    """
+    headers = dict(headers or {})
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def stats():
+    """
+    :return: {站点: 统计字典}
+    """
+    with timings.lock:
+        return {host: s.asDict() for host, s in timings.hosts.items()}
+
+
+def summary():
+    lines = ['%-24s %6s %5s %8s %6s %6s %9s %9s %9s' % (
+        'host', 'reqs', 'errs', 'KiB', 'conns', 'reused', 'conn(ms)',
+        'ttfb(ms)', 'xfer(ms)')]
+    for host, s in stats().items():
+        lines.append('%-24s %6d %5d %8.0f %6d %6d %9.1f %9.1f %9.1f' % (
+            host, s['requests'], s['errors'], s['bytes'] / 1024,
+            s['connects'], s['reused'], s['meanConnect'] * 1000,
+            s['meanFirstByte'] * 1000, s['meanTransfer'] * 1000))
+    if charsets.detections or charsets.skipped:
+        lines.append(charsets.summary())
+    return '\n'.join(lines)
@@ -6,28 +6,44 @@
 # 然后便可捕捉需要的元素以及Request Headers
 #
 
+import sys
 import json
-import requests
+import asyncio
+import argparse
+import httpclient
+import bookwriter
+from asyncfetch import AsyncFetcher, orderedResults
+from crawljournal import CrawlJournal
 
 link = 'https://www.xmkanshu.com/service/getContent?fr=xs_aladin_free&ctcrid=81&bkid=145626121&crid='
 headers = {
     'User-Agent': 'Mozilla/5.0 (Linux; Android 5.0; SM-G900P Build/LRX21T) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.66 Mobile Safari/537.36'}
-textFile = open('Big voyage.txt', 'w')
+output_path = 'Big voyage.txt'
+chapter_count = 633
 
 
-def getContent(content_link):
-    res = requests.get(content_link, headers=headers)
+def parseContent(res):
     res.raise_for_status()
-    res.encoding = res.apparent_encoding
-    jsonStr = res.text
+    jsonStr = httpclient.text(res)
     jsonData = json.loads(jsonStr)
     return jsonData['result']
 
 
+def getContent(content_link):
+    return parseContent(httpclient.get(content_link, headers=headers))
+
+
 def getCapter(chapter_id):
+    """
+    逐页顺序抓取一章
+
+    :param chapter_id: 章节编号
+    :return: 整章文本
+    """
     chapter_link = link + str(chapter_id) + '&pg='
     page = 1
     page_max = None
+    parts = []
 
     while True:
         content = getContent(chapter_link + str(page))
@@ -35,17 +51,139 @@ def getCapter(chapter_id):
             page_max = int(content['pagecount'])
 
         if page == 1:
-            textFile.write(str(chapter_id) + '.' + content['chaptername']
-                           + '\n')
-        if page == 1:
+            parts.append(str(chapter_id) + '.' + content['chaptername']
+                         + '\n')
             content['content'] = '      ' + content['content']
-        textFile.write(content['content'])
+        parts.append(content['content'])
         page += 1
         if page > page_max:
             break
-    textFile.write('\r\n')
+    return ''.join(parts)
+
+
+async def fetchCapter(fetcher, chapter_id, journal=None):
+    """
+    先抓第一页拿到 pagecount，其余分页并发抓取
+    有抓取日志时只抓日志中缺少的分页，每抓到一页立即记录
+
+    :param fetcher: AsyncFetcher
+    :param chapter_id: 章节编号
+    :param journal: CrawlJournal
+    :return: 整章文本，格式与 getCapter 的一致
+    """
+    chapter_link = link + str(chapter_id) + '&pg='
+    stored = {}
+    page_max = None
+    if journal is not None:
+        stored = {page: content
+                  for page, _, content, _ in journal.pages(link, chapter_id)}
+        page_max = journal.pageCount(link, chapter_id)
+
+    if 1 not in stored:
+        first = parseContent(await fetcher.get(chapter_link + '1'))
+        page_max = int(first['pagecount'])
+        stored[1] = (str(chapter_id) + '.' + first['chaptername'] + '\n'
+                     + '      ' + first['content'])
+        if journal is not None:
+            journal.setPageCount(link, chapter_id, page_max)
+            journal.savePage(link, chapter_id, 1, chapter_link + '1',
+                             stored[1])
+
+    async def fetchPage(page):
+        content = parseContent(await fetcher.get(chapter_link + str(page)))
+        if journal is not None:
+            journal.savePage(link, chapter_id, page, chapter_link + str(page),
+                             content['content'])
+        stored[page] = content['content']
+
+    await asyncio.gather(*[fetchPage(page) for page in range(2, page_max + 1)
+                           if page not in stored])
+    if journal is not None:
+        journal.completeChapter(link, chapter_id)
+    return ''.join(stored[page] for page in range(1, page_max + 1))
+
+
+async def downloadCapters(first, last, concurrency, rate, journal=None,
+                          writer=None):
+    """
+    并发抓取章节
+    没有抓取日志时按章节顺序交给 writer，有日志时只抓未完成的章节
+
+    :param first: 起始章节
+    :param last: 结束章节(包含)
+    :param concurrency: 同时进行的请求数
+    :param rate: 每秒最多请求数
+    :param journal: CrawlJournal
+    :param writer: bookwriter.BookWriter
+    """
+    todo = range(first, last + 1)
+    if journal is not None:
+        completed = journal.completedChapters(link)
+        todo = [chapter for chapter in todo if str(chapter) not in completed]
+        print('%d/%d 章已完成' % (
+            last - first + 1 - len(todo), last - first + 1))
+
+    fetcher = AsyncFetcher(concurrency, rate, headers)
+    try:
+        async for text in orderedResults(
+                (fetchCapter(fetcher, chapter, journal) for chapter in todo),
+                concurrency * 2):
+            if journal is None:
+                writer.writeChapter(text)
+    finally:
+        fetcher.close()
+
+
+def openOutput(path, format):
+    return bookwriter.openWriter(path, format, '\r\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='小说抓取')
+    parser.add_argument('-c', '--concurrency', type=int, default=8,
+                        help='同时进行的请求数，1 为逐页顺序抓取')
+    parser.add_argument('-r', '--rate', type=float, default=5,
+                        help='每秒最多请求数，0 表示不限')
+    parser.add_argument('--first', type=int, default=1, help='起始章节')
+    parser.add_argument('--last', type=int, default=chapter_count,
+                        help='结束章节')
+    parser.add_argument('-o', '--output', default=output_path,
+                        help='输出文件，chapters 格式为目录')
+    parser.add_argument('-f', '--format', choices=bookwriter.formats,
+                        default=None, help='输出格式，默认按扩展名推断')
+    parser.add_argument('-j', '--journal', default=None,
+                        help='抓取日志，默认为 输出文件.journal')
+    parser.add_argument('--no-journal', action='store_true',
+                        help='不记录抓取日志，每次从头抓取')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.no_journal:
+            with openOutput(args.output, args.format) as writer:
+                if args.concurrency <= 1:
+                    for chapter in range(args.first, args.last + 1):
+                        writer.writeChapter(getCapter(chapter))
+                else:
+                    asyncio.run(downloadCapters(args.first, args.last,
+                                                args.concurrency, args.rate,
+                                                writer=writer))
+        else:
+            journal = CrawlJournal(args.journal or args.output + '.journal')
+            try:
+                asyncio.run(downloadCapters(args.first, args.last,
+                                            max(args.concurrency, 1),
+                                            args.rate, journal))
+            finally:
+                # 中断时也把已抓到的部分写出来
+                with openOutput(args.output, args.format) as writer:
+                    missing = journal.rebuild(
+                        link, range(args.first, args.last + 1), writer)
+                journal.close()
+            if missing:
+                print('%d 章未完成，重新运行可继续抓取' % missing)
+    finally:
+        print(httpclient.summary())
 
 
-for chapter in range(1, 634):
-    getCapter(chapter)
-textFile.close()
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+#! python3
+#
+# 2048 主循环的性能统计
+# 每个阶段(读取页面、建棋盘、搜索、按键、等待)单独计时，记录到对数分桶的直方图，
+# 输出次数、总时间、占比和 p50 / p95 / p99
+# 退出时或收到信号(POSIX: SIGUSR1, Windows: Ctrl+Break)时打印汇总
+# 可选 cProfile 或采样模式，查看搜索内部 move / evaluate 的耗时
+#
+
+import sys
+import time
+import atexit
+import bisect
+import signal
+import threading
+
+bucketRatio = 1.1  # 相邻桶边界的比例，分位数相对误差不超过 10%
+bucketMin = 1e-6  # 1 微秒
+bucketMax = 100.0  # 100 秒
+
+
+def buildBounds():
+    bounds = []
+    bound = bucketMin
+    while bound < bucketMax:
+        bounds.append(bound)
+        bound *= bucketRatio
+    return bounds
+
+
+bucketBounds = buildBounds()
+
+
+class Histogram:
+    """
+    对数分桶的延迟直方图，记录开销与样本数无关
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(bucketBounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(bucketBounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """
+        :param fraction: 0 ~ 1
+        :return: 所在桶的上边界(秒)
+        """
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target and count:
+                if idx < len(bucketBounds):
+                    return min(bucketBounds[idx], self.max)
+                return self.max
+        return self.max
+
+
+class PhaseTimer:
+    """
+    分阶段计时
+
+    start = time.perf_counter()
+    ...
+    timer.record('search', time.perf_counter() - start)
+    """
+
+    def __init__(self):
+        self.phases = {}  # 阶段名 -> Histogram，按第一次出现的顺序
+        self.counters = {}  # 计数器，例如搜索节点数
+        self.started = time.perf_counter()
+
+    def record(self, name, seconds):
+        histogram = self.phases.get(name)
+        if histogram is None:
+            histogram = self.phases[name] = Histogram()
+        histogram.record(seconds)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        lines = ['%-10s %8s %10s %6s %9s %9s %9s %9s %9s' % (
+            'phase', 'count', 'total(s)', 'share', 'mean(ms)', 'p50(ms)',
+            'p95(ms)', 'p99(ms)', 'max(ms)')]
+        for name, h in self.phases.items():
+            if not h.count:
+                continue
+            lines.append('%-10s %8d %10.3f %5.1f%% %9.3f %9.3f %9.3f %9.3f '
+                         '%9.3f' % (
+                             name, h.count, h.total,
+                             h.total / wall * 100 if wall else 0.0,
+                             h.total / h.count * 1000,
+                             h.percentile(0.50) * 1000,
+                             h.percentile(0.95) * 1000,
+                             h.percentile(0.99) * 1000, h.max * 1000))
+        for name, value in self.counters.items():
+            lines.append('%-10s %8d %10.0f/s' % (name, value,
+                                                 value / wall if wall else 0))
+        lines.append('wall %.3fs' % wall)
+        return '\n'.join(lines)
+
+    def dump(self, *args):
+        print(self.summary(), file=sys.stderr)
+
+
+class Sampler:
+    """
+    采样剖析: 后台线程定时抓取目标线程的调用栈，统计函数出现次数
+    开销只与采样频率有关，适合长时间运行
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.threadId = thread_id or threading.get_ident()
+        self.samples = {}  # (文件, 函数) -> [自身次数, 累计次数]
+        self.total = 0
+        # 信号或退出时输出统计，采样线程仍在写入，两边都要持锁
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                continue
+            with self.lock:
+                self.record(frame)
+
+    def record(self, frame):
+        self.total += 1
+        seen = set()
+        leaf = True
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_filename, code.co_name)
+            entry = self.samples.get(key)
+            if entry is None:
+                entry = self.samples[key] = [0, 0]
+            if leaf:
+                entry[0] += 1
+                leaf = False
+            if key not in seen:
+                entry[1] += 1
+                seen.add(key)
+            frame = frame.f_back
+
+    def summary(self, limit=20):
+        with self.lock:
+            total = self.total
+            samples = [(key, tuple(entry))
+                       for key, entry in self.samples.items()]
+        lines = ['%8s %8s  %s' % ('self%', 'total%', 'function')]
+        if not total:
+            return '\n'.join(lines)
+        ordered = sorted(samples, key=lambda item: -item[1][0])
+        for (filename, name), (selfCount, totalCount) in ordered[:limit]:
+            lines.append('%7.1f%% %7.1f%%  %s (%s)' % (
+                selfCount / total * 100, totalCount / total * 100,
+                name, filename))
+        return '\n'.join(lines)
+
+
+class Profiler:
+    """
+    汇总 PhaseTimer 与可选的 cProfile / 采样剖析，负责退出和信号时输出
+    """
+
+    def __init__(self, mode=None, profile_path=None):
+        """
+        :param mode: None 只统计阶段耗时, 'cprofile' 或 'sample'
+        :param profile_path: cProfile 结果保存路径(pstats 格式)
+        """
+        self.timer = PhaseTimer()
+        self.mode = mode
+        self.profilePath = profile_path
+        self.cProfile = None
+        self.sampler = None
+        if mode == 'cprofile':
+            import cProfile
+            self.cProfile = cProfile.Profile()
+            self.cProfile.enable()
+        elif mode == 'sample':
+            self.sampler = Sampler()
+            self.sampler.start()
+        elif mode is not None:
+            raise ValueError('unknown profile mode: %s' % mode)
+
+    def record(self, name, seconds):
+        self.timer.record(name, seconds)
+
+    def count(self, name, value=1):
+        self.timer.count(name, value)
+
+    def dump(self, *args):
+        print(self.timer.summary(), file=sys.stderr)
+        if self.cProfile is not None:
+            import pstats
+            self.cProfile.disable()
+            stats = pstats.Stats(self.cProfile, stream=sys.stderr)
+            stats.sort_stats('tottime').print_stats(20)
+            if self.profilePath:
+                stats.dump_stats(self.profilePath)
+            self.cProfile.enable()
+        if self.sampler is not None and self.sampler.total:
+            print(self.sampler.summary(), file=sys.stderr)
+
+    def install(self):
+        """
+        注册退出和信号时输出汇总
+        """
+        atexit.register(self.dump)
+        for name in ('SIGUSR1', 'SIGBREAK'):
+            signum = getattr(signal, name, None)
+            if signum is not None:
+                signal.signal(signum, self.dump)
+        return self
@@ -0,0 +1,418 @@
+#! python3
+#
+# 2048 expectimax 搜索
+# 玩家节点取四个方向的最大值，机会节点按出现 2(0.9) / 4(0.1) 的概率加权平均
+# 迭代加深，在限定时间内尽量搜索更深
+# 置换表缓存玩家节点的结果，不同走法顺序到达同一局面时直接复用
+# ParallelSearcher 把根节点各方向下的机会节点子树分给常驻的进程池
+#
+
+import os
+import time
+import multiprocessing
+from array import array
+from board2048 import moveFunctions, countEmpty
+from heuristic2048 import Heuristic
+
+probThreshold = 0.0001  # 累计概率低于该值的分支直接静态评估
+lostScore = -1000.0  # 无路可走的局面
+checkInterval = 256  # 每搜索多少节点检查一次时间
+tileProbabilities = [(1, 0.9), (2, 0.1)]  # (指数, 概率)
+tableBytes = 32 * 1024 * 1024  # 置换表默认内存上限
+
+
+class SearchTimeout(Exception):
+    """
+    搜索超时，丢弃当前深度的结果
+    """
+
+
+class TranspositionTable:
+    """
+    置换表
+    槽位数固定(2 的幂)，内存上限在创建时确定，不会增长
+    同一槽位冲突时深度优先替换: 新结果深度不低于旧结果才覆盖
+    """
+
+    # 每个槽位: 棋盘 8 字节 + 深度 1 字节 + 分数 8 字节 + 方向 1 字节
+    entryBytes = 18
+
+    def __init__(self, max_bytes=tableBytes):
+        """
+        :param max_bytes: 内存上限(字节)
+        """
+        bits = 0
+        while (2 << bits) * TranspositionTable.entryBytes <= max_bytes:
+            bits += 1
+        self.size = 1 << bits
+        self.shift = 64 - bits
+        self.boards = array('Q', [0]) * self.size
+        self.depths = array('b', [-1]) * self.size  # -1 表示空槽
+        self.scores = array('d', [0.0]) * self.size
+        self.moves = array('b', [-1]) * self.size
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # 覆盖了其他局面
+        self.rejects = 0  # 深度不足未能写入
+
+    def index(self, board):
+        # Fibonacci hashing，取乘积的高位
+        return (((board * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF)
+                >> self.shift)
+
+    def lookup(self, board, depth):
+        """
+        查找局面
+
+        :param board: 位棋盘
+        :param depth: 需要的最小剩余深度
+        :return: (分数, 最佳方向)，未命中返回 None
+        """
+        idx = self.index(board)
+        if self.boards[idx] == board and self.depths[idx] >= depth:
+            self.hits += 1
+            return self.scores[idx], self.moves[idx]
+        self.misses += 1
+        return None
+
+    def store(self, board, depth, score, move):
+        idx = self.index(board)
+        oldDepth = self.depths[idx]
+        if oldDepth < 0:
+            self.used += 1
+        elif self.boards[idx] != board:
+            if depth < oldDepth:
+                self.rejects += 1
+                return
+            self.evictions += 1
+        elif depth < oldDepth:
+            return
+        self.boards[idx] = board
+        self.depths[idx] = depth
+        self.scores[idx] = score
+        self.moves[idx] = move
+
+    def clear(self):
+        # 只需把深度全部置为空槽，整块重建比逐个赋值快得多
+        self.depths = array('b', [-1]) * self.size
+        self.used = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': self.size,
+            'bytes': self.size * TranspositionTable.entryBytes,
+            'used': self.used,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'rejects': self.rejects,
+        }
+
+
+class Searcher:
+    """
+    迭代加深的 expectimax 搜索
+    """
+
+    def __init__(self, search_time=100, max_depth=8, heuristic=None,
+                 table_bytes=tableBytes):
+        """
+        :param search_time: 每步搜索时间(毫秒)
+        :param max_depth: 最大搜索深度(玩家步数)
+        :param heuristic: 静态评估 board -> score，默认 Heuristic()
+        :param table_bytes: 置换表内存上限(字节)，0 表示不使用置换表
+        """
+        self.searchTime = search_time
+        self.maxDepth = max_depth
+        self.heuristic = heuristic if heuristic is not None else Heuristic()
+        self.heuristicVersion = getattr(self.heuristic, 'version', None)
+        self.table = TranspositionTable(table_bytes) if table_bytes else None
+        self.searches = 0  # 累计搜索次数
+        self.deadline = None
+        self.nextCheck = 0
+        self.nodes = 0  # 本次搜索的节点数
+        self.depth = 0  # 本次搜索完成的深度
+        self.score = None
+        self.elapsed = 0.0  # 本次搜索用时(毫秒)
+
+    def search(self, board):
+        """
+        搜索最佳方向
+
+        :param board: 位棋盘
+        :return: 方向，无路可走返回 None
+        """
+        start = time.perf_counter()
+        budget = self.searchTime / 1000.0
+        self.nodes = 0
+        self.depth = 0
+        self.score = None
+        self.searches += 1
+
+        self.checkHeuristic()
+
+        direction = None
+        for depth in range(1, self.maxDepth + 1):
+            # 第一层必须搜完，保证总有结果
+            self.deadline = None if depth == 1 else start + budget
+            self.nextCheck = self.nodes + checkInterval
+            try:
+                result = self.searchRoot(board, depth)
+            except SearchTimeout:
+                break
+            if result[0] is None:
+                break
+            direction, self.score = result
+            self.depth = depth
+            # 剩余时间不足以完成更深一层
+            if time.perf_counter() - start > budget / 2:
+                break
+
+        self.elapsed = (time.perf_counter() - start) * 1000
+        return direction
+
+    def tableStats(self):
+        return self.table.stats() if self.table is not None else None
+
+    def close(self):
+        """
+        与 ParallelSearcher 接口一致，单进程无需释放
+        """
+
+    def checkHeuristic(self):
+        # 权重变化后置换表里的分数已经过期
+        version = getattr(self.heuristic, 'version', None)
+        if version != self.heuristicVersion:
+            self.heuristicVersion = version
+            if self.table is not None:
+                self.table.clear()
+
+    def searchNode(self, board, depth, prob, deadline):
+        """
+        搜索单个玩家节点，供并行搜索的工作进程调用
+
+        :param board: 位棋盘
+        :param depth: 剩余深度
+        :param prob: 到达该节点的累计概率
+        :param deadline: 截止时间(time.time())
+        :return: 分数，超时返回 None
+        """
+        self.nodes = 0
+        self.checkHeuristic()
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None
+        self.deadline = time.perf_counter() + remaining
+        self.nextCheck = checkInterval
+        try:
+            return self.maxNode(board, depth, prob)
+        except SearchTimeout:
+            return None
+
+    def searchRoot(self, board, depth):
+        direction = None
+        score = None
+        for v in range(4):
+            newBoard = moveFunctions[v](board)
+            if newBoard == board:
+                continue
+            value = self.chanceNode(newBoard, depth - 1, 1.0)
+            if score is None or value > score:
+                score = value
+                direction = v
+        return direction, score
+
+    def maxNode(self, board, depth, prob):
+        self.nodes += 1
+        if self.deadline is not None and self.nodes >= self.nextCheck:
+            self.nextCheck = self.nodes + checkInterval
+            if time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+
+        table = self.table
+        if table is not None:
+            entry = table.lookup(board, depth)
+            if entry is not None:
+                return entry[0]
+
+        best = lostScore
+        bestMove = -1
+        for v in range(4):
+            newBoard = moveFunctions[v](board)
+            if newBoard != board:
+                value = self.chanceNode(newBoard, depth - 1, prob)
+                if value > best:
+                    best = value
+                    bestMove = v
+
+        if table is not None:
+            table.store(board, depth, best, bestMove)
+        return best
+
+    def chanceNode(self, board, depth, prob):
+        if depth <= 0 or prob < probThreshold:
+            self.nodes += 1
+            return self.heuristic(board)
+
+        emptyCells = countEmpty(board)
+        prob /= emptyCells
+        total = 0.0
+        shift = 0
+        while shift < 64:
+            if not (board >> shift) & 0xF:
+                for rank, p in tileProbabilities:
+                    total += p * self.maxNode(board | (rank << shift), depth,
+                                              prob * p)
+            shift += 4
+        return total / emptyCells
+
+
+workerSearcher = None  # 工作进程内常驻的搜索器，查找表和置换表跨步保留
+
+
+def initWorker(table_bytes):
+    global workerSearcher
+    workerSearcher = Searcher(table_bytes=table_bytes)
+
+
+def searchChild(task):
+    """
+    工作进程: 搜索机会节点下的一个子节点
+
+    :param task: (棋盘, 剩余深度, 累计概率, 截止时间, 权重)
+    :return: (分数或 None, 节点数, 进程号, 置换表统计)
+    """
+    board, depth, prob, deadline, weights = task
+    searcher = workerSearcher
+    if searcher.heuristic.weights != weights:
+        searcher.heuristic.setWeights(**weights)
+    value = searcher.searchNode(board, depth, prob, deadline)
+    stats = searcher.table.stats() if searcher.table is not None else None
+    return value, searcher.nodes, os.getpid(), stats
+
+
+class ParallelSearcher:
+    """
+    多进程 expectimax 搜索
+    根节点每个方向移动后的机会节点按 空格 x {2, 4} 拆成子任务分给进程池，
+    每一层深度所有子任务完成后再加深，超时的一层整体丢弃
+    工作进程常驻，评估表和置换表不会每步重建
+    """
+
+    def __init__(self, search_time=100, max_depth=8, heuristic=None,
+                 table_bytes=tableBytes, workers=None):
+        """
+        :param search_time: 每步搜索时间(毫秒)
+        :param max_depth: 最大搜索深度(玩家步数)
+        :param heuristic: Heuristic，权重会同步到工作进程
+        :param table_bytes: 每个工作进程的置换表内存上限(字节)
+        :param workers: 进程数，默认 CPU 核数
+        """
+        self.searchTime = search_time
+        self.maxDepth = max_depth
+        self.heuristic = heuristic if heuristic is not None else Heuristic()
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = multiprocessing.Pool(self.workers, initWorker,
+                                         (table_bytes,))
+        self.table = None  # 置换表在工作进程中，见 tableStats
+        self.workerStats = {}
+        self.searches = 0
+        self.nodes = 0
+        self.depth = 0
+        self.score = None
+        self.elapsed = 0.0
+
+    def search(self, board):
+        """
+        搜索最佳方向
+
+        :param board: 位棋盘
+        :return: 方向，无路可走返回 None
+        """
+        start = time.time()
+        budget = self.searchTime / 1000.0
+        deadline = start + budget
+        self.nodes = 0
+        self.depth = 0
+        self.score = None
+        self.searches += 1
+
+        moves = []
+        for v in range(4):
+            newBoard = moveFunctions[v](board)
+            if newBoard != board:
+                moves.append((v, newBoard))
+        if not moves:
+            self.elapsed = (time.time() - start) * 1000
+            return None
+
+        # 第一层直接评估
+        direction = None
+        for v, newBoard in moves:
+            value = self.heuristic(newBoard)
+            self.nodes += 1
+            if self.score is None or value > self.score:
+                self.score = value
+                direction = v
+        self.depth = 1
+
+        # 子任务: (方向, 子节点, 概率 / 空格数)
+        children = []
+        for v, newBoard in moves:
+            emptyCells = countEmpty(newBoard)
+            for shift in range(0, 64, 4):
+                if not (newBoard >> shift) & 0xF:
+                    for rank, p in tileProbabilities:
+                        children.append((v, newBoard | (rank << shift),
+                                         p / emptyCells))
+
+        weights = dict(self.heuristic.weights)
+        for depth in range(2, self.maxDepth + 1):
+            # 剩余时间不足以完成更深一层
+            if time.time() - start > budget / 2:
+                break
+            tasks = [(child, depth - 1, prob, deadline, weights)
+                     for v, child, prob in children]
+            results = self.pool.map(searchChild, tasks, chunksize=1)
+
+            values = {}
+            complete = True
+            for (v, child, prob), (value, nodes, pid, stats) in zip(
+                    children, results):
+                self.nodes += nodes
+                if stats is not None:
+                    self.workerStats[pid] = stats
+                if value is None:
+                    complete = False
+                else:
+                    values[v] = values.get(v, 0.0) + prob * value
+            if not complete:
+                break
+
+            direction = max(values, key=values.get)
+            self.score = values[direction]
+            self.depth = depth
+
+        self.elapsed = (time.time() - start) * 1000
+        return direction
+
+    def tableStats(self):
+        """
+        汇总各工作进程的置换表统计
+        """
+        if not self.workerStats:
+            return None
+        total = {}
+        for stats in self.workerStats.values():
+            for key, value in stats.items():
+                total[key] = total.get(key, 0) + value
+        lookups = total.get('hits', 0) + total.get('misses', 0)
+        total['hitRate'] = total['hits'] / lookups if lookups else 0.0
+        return total
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,295 @@
+#! python3
+#
+# 2048 离线自对弈模拟与基准测试
+# 使用 board2048 的移动规则加随机出现 2(0.9) / 4(0.1)，多进程并行跑固定种子的对局
+# 统计 步数/秒、节点/秒、得分分布和最大块达成率，可保存为 JSON 基线并与之比较
+#
+# Usage: python simulate2048.py -n 8 -j 4 --depth 2 --save baseline.json
+# Usage: python simulate2048.py -n 8 -j 4 --depth 2 --compare baseline.json
+#
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import multiprocessing
+from board2048 import moveBoard, maxRank
+from search2048 import Searcher, tileProbabilities
+
+workerSearcher = None  # 工作进程内常驻的搜索器
+
+
+def spawnTile(board, rnd):
+    """
+    在随机空格上放一个 2 或 4
+
+    :param board: 位棋盘
+    :param rnd: random.Random
+    :return: (新棋盘, 指数)，没有空格返回 (board, 0)
+    """
+    cells = [shift for shift in range(0, 64, 4) if not (board >> shift) & 0xF]
+    if not cells:
+        return board, 0
+    shift = rnd.choice(cells)
+    rank = tileProbabilities[0][0]
+    if rnd.random() >= tileProbabilities[0][1]:
+        rank = tileProbabilities[1][0]
+    return board | (rank << shift), rank
+
+
+def gameScore(board, fours):
+    """
+    根据最终棋盘计算得分
+    指数为 r 的块由 2 合成时累计得分 (r - 1) * 2^r，直接出现的 4 没有合并得分
+
+    :param board: 位棋盘
+    :param fours: 出现 4 的次数
+    :return: 得分
+    """
+    score = 0
+    while board:
+        rank = board & 0xF
+        if rank >= 2:
+            score += (rank - 1) * (1 << rank)
+        board >>= 4
+    return score - 4 * fours
+
+
+def initWorker(table_bytes):
+    global workerSearcher
+    workerSearcher = Searcher(table_bytes=table_bytes)
+
+
+def playGame(task):
+    """
+    跑一局
+
+    :param task: (种子, 每步搜索时间毫秒(0 不限时), 最大深度, 最大步数, 权重)
+    :return: 对局结果
+    """
+    seed, searchTime, maxDepth, maxMoves, weights = task
+    searcher = workerSearcher
+    searcher.searchTime = searchTime or float('inf')
+    searcher.maxDepth = maxDepth
+    if weights and searcher.heuristic.weights != weights:
+        searcher.heuristic.setWeights(**weights)
+    # 权重变化后的置换表清空放在计时之前，不计入第一步的耗时
+    searcher.checkHeuristic()
+
+    rnd = random.Random(seed)
+    fours = 0
+    board, rank = spawnTile(0, rnd)
+    fours += rank == 2
+    board, rank = spawnTile(board, rnd)
+    fours += rank == 2
+
+    moves = 0
+    nodes = 0
+    depths = 0
+    start = time.perf_counter()
+    while not maxMoves or moves < maxMoves:
+        direction = searcher.search(board)
+        if direction is None:
+            break
+        nodes += searcher.nodes
+        depths += searcher.depth
+        board = moveBoard(board, direction)
+        moves += 1
+        board, rank = spawnTile(board, rnd)
+        fours += rank == 2
+    seconds = time.perf_counter() - start
+
+    return {
+        'seed': seed,
+        'score': gameScore(board, fours),
+        'maxTile': 1 << maxRank(board),
+        'moves': moves,
+        'nodes': nodes,
+        'meanDepth': depths / moves if moves else 0.0,
+        'seconds': seconds,
+        'board': '%016x' % board,
+    }
+
+
+def createPool(workers=None, table_bytes=8 * 1024 * 1024):
+    """
+    创建模拟用的进程池，可在多次 runGames 之间复用
+    """
+    return multiprocessing.Pool(workers or os.cpu_count() or 1, initWorker,
+                                (table_bytes,))
+
+
+def runGames(count, seed=0, workers=None, search_time=0, max_depth=2,
+             max_moves=0, weights=None, table_bytes=8 * 1024 * 1024,
+             pool=None):
+    """
+    并行跑多局
+
+    :param count: 对局数，第 i 局的种子为 seed + i
+    :param seed: 起始种子
+    :param workers: 进程数，默认 CPU 核数
+    :param search_time: 每步搜索时间(毫秒)，0 表示只按深度限制
+    :param max_depth: 最大搜索深度
+    :param max_moves: 每局最大步数，0 表示不限
+    :param weights: 评估权重，None 使用默认值
+    :param table_bytes: 每个进程的置换表内存上限
+    :param pool: createPool 创建的进程池，None 时临时创建
+    :return: (对局结果列表, 总用时秒)
+    """
+    tasks = [(seed + i, search_time, max_depth, max_moves, weights)
+             for i in range(count)]
+    start = time.perf_counter()
+    if pool is not None:
+        results = pool.map(playGame, tasks, chunksize=1)
+    else:
+        workers = min(workers or os.cpu_count() or 1, count)
+        with createPool(workers, table_bytes) as tempPool:
+            results = tempPool.map(playGame, tasks, chunksize=1)
+    return results, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    idx = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[idx]
+
+
+def summarize(results, wall):
+    """
+    统计对局结果
+
+    :param results: runGames 的对局结果
+    :param wall: 总用时(秒)
+    :return: 统计字典
+    """
+    scores = [r['score'] for r in results]
+    moves = sum(r['moves'] for r in results)
+    nodes = sum(r['nodes'] for r in results)
+    cpu = sum(r['seconds'] for r in results)
+    tiles = {}
+    for r in results:
+        tile = 2
+        while tile <= r['maxTile']:
+            tiles[tile] = tiles.get(tile, 0) + 1
+            tile *= 2
+    return {
+        'games': len(results),
+        'moves': moves,
+        'nodes': nodes,
+        'wallSeconds': wall,
+        'movesPerSec': moves / wall if wall else 0.0,
+        'nodesPerSec': nodes / wall if wall else 0.0,
+        # 单进程吞吐，不受并行进程数影响，适合跨机器比较
+        'movesPerCpuSec': moves / cpu if cpu else 0.0,
+        'nodesPerCpuSec': nodes / cpu if cpu else 0.0,
+        'meanDepth': (sum(r['meanDepth'] * r['moves'] for r in results)
+                      / moves if moves else 0.0),
+        'score': {
+            'mean': statistics.mean(scores),
+            'stdev': statistics.pstdev(scores),
+            'min': min(scores),
+            'p25': percentile(scores, 0.25),
+            'median': statistics.median(scores),
+            'p75': percentile(scores, 0.75),
+            'max': max(scores),
+        },
+        'maxTileRates': {str(tile): tiles[tile] / len(results)
+                         for tile in sorted(tiles) if tile >= 256},
+    }
+
+
+def printSummary(summary):
+    print('games %d moves %d nodes %d in %.1fs' % (
+        summary['games'], summary['moves'], summary['nodes'],
+        summary['wallSeconds']))
+    print('%.1f moves/s %.0f nodes/s (per cpu %.1f moves/s %.0f nodes/s) '
+          'mean depth %.2f' % (
+              summary['movesPerSec'], summary['nodesPerSec'],
+              summary['movesPerCpuSec'], summary['nodesPerCpuSec'],
+              summary['meanDepth']))
+    print('score mean {mean:.0f} stdev {stdev:.0f} min {min} p25 {p25} '
+          'median {median:.0f} p75 {p75} max {max}'.format(**summary['score']))
+    for tile, rate in summary['maxTileRates'].items():
+        print('%6s %5.1f%%' % (tile, rate * 100))
+
+
+def compareBaseline(summary, baseline, tolerance):
+    """
+    与基线比较，吞吐或得分下降超过 tolerance 视为退化
+
+    :return: 是否退化
+    """
+    metrics = [
+        ('movesPerCpuSec', summary['movesPerCpuSec'],
+         baseline['movesPerCpuSec']),
+        ('nodesPerCpuSec', summary['nodesPerCpuSec'],
+         baseline['nodesPerCpuSec']),
+        ('score.mean', summary['score']['mean'], baseline['score']['mean']),
+        ('score.median', summary['score']['median'],
+         baseline['score']['median']),
+    ]
+    regressed = False
+    print()
+    print('%-16s %12s %12s %8s' % ('metric', 'baseline', 'current', 'change'))
+    for name, current, base in metrics:
+        change = (current - base) / base if base else 0.0
+        mark = ''
+        if change < -tolerance:
+            mark = ' REGRESSION'
+            regressed = True
+        print('%-16s %12.1f %12.1f %+7.1f%%%s' % (
+            name, base, current, change * 100, mark))
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='2048 AI 离线自对弈基准')
+    parser.add_argument('-n', '--games', type=int, default=8, help='对局数')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='进程数，默认 CPU 核数')
+    parser.add_argument('--seed', type=int, default=0, help='起始种子')
+    parser.add_argument('--time', type=int, default=0,
+                        help='每步搜索时间(毫秒)，0 表示只按深度限制')
+    parser.add_argument('--depth', type=int, default=2, help='最大搜索深度')
+    parser.add_argument('--max-moves', type=int, default=0,
+                        help='每局最大步数，0 表示不限')
+    parser.add_argument('--save', help='保存结果为 JSON 基线')
+    parser.add_argument('--compare', help='与 JSON 基线比较')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='允许的下降比例')
+    args = parser.parse_args(argv)
+
+    config = {
+        'games': args.games,
+        'seed': args.seed,
+        'time': args.time,
+        'depth': args.depth,
+        'maxMoves': args.max_moves,
+    }
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baselineFile:
+            baseline = json.load(baselineFile)
+        if baseline['config'] != config:
+            print('warning: baseline config differs: %s' % baseline['config'])
+
+    results, wall = runGames(args.games, args.seed, args.workers, args.time,
+                             args.depth, args.max_moves)
+    summary = summarize(results, wall)
+    printSummary(summary)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as baselineFile:
+            json.dump({'config': config, 'summary': summary,
+                       'results': results}, baselineFile, indent=2)
+
+    if args.compare and compareBaseline(summary, baseline['summary'],
+                                        args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#! python3
+# 广度优先的并发站点爬虫
+# 待抓取队列(frontier)按层推进，链接规范化后去重，每个页面只抓一次
+# 已访问集合默认用 set，页面非常多时可以换成布隆过滤器，内存固定，有很小的误判率(误判的页面会被跳过)
+# 并发数和每个站点的请求频率由 AsyncFetcher 控制
+#
+
+import math
+import asyncio
+import hashlib
+from urllib.parse import urljoin, urlsplit, urlunsplit
+import requests
+
+defaultPorts = {'http': 80, 'https': 443}
+
+
+def normalizeUrl(url, base=None):
+    """
+    规范化链接: 补全相对链接，协议和域名转小写，去掉默认端口和 #片段，空路径改为 /
+
+    :param url: 链接
+    :param base: 所在页面链接，用于补全相对链接
+    :return: 规范化后的链接，不是 http(s) 链接时返回 None
+    """
+    if base is not None:
+        url = urljoin(base, url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in defaultPorts or not parts.hostname:
+        return None
+    netloc = parts.hostname
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    if port is not None and port != defaultPorts[scheme]:
+        netloc += ':%d' % port
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class VisitedSet:
+    """
+    精确的已访问集合
+    """
+
+    def __init__(self):
+        self.items = set()
+
+    def add(self, item):
+        """
+        :return: 之前不存在返回 True
+        """
+        if item in self.items:
+            return False
+        self.items.add(item)
+        return True
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class BloomFilter:
+    """
+    布隆过滤器，接口与 VisitedSet 相同
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        """
+        :param capacity: 预计元素数
+        :param error_rate: 达到预计元素数时的误判率
+        """
+        self.bits = max(int(-capacity * math.log(error_rate)
+                            / math.log(2) ** 2), 8)
+        self.hashes = max(int(round(self.bits / capacity * math.log(2))), 1)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        """
+        :return: 之前(可能)不存在返回 True
+        """
+        added = False
+        for pos in self.positions(item):
+            mask = 1 << (pos & 7)
+            if not self.array[pos >> 3] & mask:
+                self.array[pos >> 3] |= mask
+                added = True
+        self.count += added
+        return added
+
+    def __contains__(self, item):
+        return all(self.array[pos >> 3] & (1 << (pos & 7))
+                   for pos in self.positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+class Crawler:
+    """
+    并发广度优先爬虫
+
+    parse(url, res) 解析页面，返回 (记录列表, 链接列表)，记录逐个交给 sink(record)
+    """
+
+    def __init__(self, fetcher, parse, sink, max_depth=10, max_pages=None,
+                 same_host=True, visited=None):
+        """
+        :param fetcher: AsyncFetcher，决定并发数和请求频率
+        :param parse: 页面解析函数
+        :param sink: 记录输出函数
+        :param max_depth: 最大深度，起始页为 0
+        :param max_pages: 最多抓取的页面数，None 表示不限
+        :param same_host: 只抓起始页所在的站点
+        :param visited: 已访问集合，默认 VisitedSet
+        """
+        self.fetcher = fetcher
+        self.parse = parse
+        self.sink = sink
+        self.maxDepth = max_depth
+        self.maxPages = max_pages
+        self.sameHost = same_host
+        self.visited = visited if visited is not None else VisitedSet()
+        self.hosts = set()
+        self.queue = None
+        self.pages = 0  # 已抓取页面数
+        self.errors = 0
+        self.duplicates = 0  # 因为已访问而跳过的链接数
+        self.records = 0
+
+    def enqueue(self, url, depth, base=None):
+        url = normalizeUrl(url, base)
+        if url is None:
+            return
+        if self.sameHost and urlsplit(url).netloc not in self.hosts:
+            return
+        if not self.visited.add(url):
+            self.duplicates += 1
+            return
+        self.queue.put_nowait((url, depth))
+
+    async def worker(self):
+        while True:
+            url, depth = await self.queue.get()
+            try:
+                if self.maxPages is not None and self.pages >= self.maxPages:
+                    continue
+                self.pages += 1
+                try:
+                    res = await self.fetcher.get(url)
+                except requests.RequestException:
+                    self.errors += 1
+                    continue
+                if res.status_code != requests.codes.ok:
+                    self.errors += 1
+                    continue
+                records, links = self.parse(url, res)
+                for record in records:
+                    self.records += 1
+                    self.sink(record)
+                if depth < self.maxDepth:
+                    for link in links:
+                        self.enqueue(link, depth + 1, url)
+            finally:
+                self.queue.task_done()
+
+    async def crawl(self, start_urls):
+        """
+        抓取到队列为空为止
+
+        :param start_urls: 起始链接
+        """
+        self.queue = asyncio.Queue()
+        for url in start_urls:
+            url = normalizeUrl(url)
+            if url is not None:
+                self.hosts.add(urlsplit(url).netloc)
+                self.enqueue(url, 0)
+        workers = [asyncio.ensure_future(self.worker())
+                   for _ in range(self.fetcher.concurrency)]
+        join = asyncio.ensure_future(self.queue.join())
+        try:
+            # 解析出错时 worker 会异常退出，不再等待队列
+            await asyncio.wait([join] + workers,
+                               return_when=asyncio.FIRST_COMPLETED)
+            for task in workers:
+                if task.done():
+                    task.result()
+        finally:
+            join.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    def summary(self):
+        return ('pages %d errors %d duplicates %d visited %d records %d' % (
+            self.pages, self.errors, self.duplicates, len(self.visited),
+            self.records))
@@ -0,0 +1,105 @@
+#! python3
+# 命令行启动耗时测试
+# cold: 每次运行使用新的空 PYTHONPYCACHEPREFIX，所有模块(包括标准库)都要重新编译
+# warm: 共用一个已经生成 .pyc 的 PYTHONPYCACHEPREFIX，相当于平时反复运行
+# 最后用 -X importtime 列出 warm 运行时导入最慢的模块
+# 操作系统的文件缓存无法清空，cold 只模拟没有字节码缓存的情况
+#
+# python startupbench.py                 默认测试 weather.py 的几个离线命令
+# python startupbench.py -n 20 -- weather.py --search 朝阳
+#
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+directory = os.path.dirname(os.path.abspath(__file__))
+# 名字, 参数；weather.py 的查找需要本地站点字典，先运行 --build-stations
+default_commands = [
+    ('python -c pass', ['-c', 'pass']),
+    ('eager imports', ['-c', 'import pypinyin, requests, bs4, prettytable']),
+    ('weather.py', ['weather.py']),
+    ('weather.py --search 北京', ['weather.py', '--search', '北京']),
+    ('weather.py 北京 x', ['weather.py', '北京', 'x']),
+]
+
+
+def run(args, prefix):
+    """
+    :return: 运行一次的耗时(秒)
+    """
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=prefix)
+    # 不写 .pyc 时 warm 与 cold 相同
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, cwd=directory, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def measure(args, repeat):
+    """
+    :return: (cold 耗时列表, warm 耗时列表)
+    """
+    cold = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as prefix:
+            cold.append(run(args, prefix))
+    with tempfile.TemporaryDirectory() as prefix:
+        run(args, prefix)
+        warm = [run(args, prefix) for _ in range(repeat)]
+    return cold, warm
+
+
+def slowest_imports(args, limit=8):
+    """
+    :return: [(累计耗时(微秒), 模块名)]，只统计顶层导入
+    """
+    res = subprocess.run([sys.executable, '-X', 'importtime'] + args,
+                         cwd=directory, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    imports = []
+    for line in res.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 顶层导入没有缩进
+        if name.startswith(' ') and not name.startswith('  '):
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    extra = []
+    if '--' in argv:
+        extra = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    parser = argparse.ArgumentParser(description='命令行启动耗时测试',
+                                     epilog='-- 之后为要测试的脚本和参数')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='cold 和 warm 各运行的次数')
+    args = parser.parse_args(argv)
+
+    commands = [(' '.join(extra), extra)] if extra else default_commands
+    print('%-28s %10s %10s %10s %10s' % (
+        'command', 'cold(ms)', 'min', 'warm(ms)', 'min'))
+    for name, command in commands:
+        cold, warm = measure(command, args.repeat)
+        print('%-28s %10.1f %10.1f %10.1f %10.1f' % (
+            name, sum(cold) / len(cold) * 1000, min(cold) * 1000,
+            sum(warm) / len(warm) * 1000, min(warm) * 1000))
+
+    name, command = commands[-1]
+    print()
+    print('slowest imports: %s' % name)
+    for cumulative, module in slowest_imports(command):
+        print('%10.1f ms  %s' % (cumulative / 1000, module))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
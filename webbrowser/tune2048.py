@@ -0,0 +1,209 @@
+#! python3
+#
+# 2048 评估权重调优
+# 坐标下降: 依次对每个权重尝试 +step / -step，用同一组种子的自对弈平均分比较，
+# 变好就接受，两边都不好就把该权重的步长减半
+# 每次评估后写检查点，中断后用同样的命令即可继续
+# 结束时输出最佳权重，以及不同搜索深度下 得分 / 吞吐 的对照
+#
+# Usage: python tune2048.py -n 16 --depth 1 --checkpoint tune.json
+#
+
+import os
+import sys
+import json
+import argparse
+from heuristic2048 import weightNames, defaultWeights
+from simulate2048 import createPool, runGames, summarize
+
+
+def loadCheckpoint(path):
+    try:
+        with open(path, encoding='utf-8') as checkpointFile:
+            return json.load(checkpointFile)
+    except FileNotFoundError:
+        return None
+
+
+def saveCheckpoint(path, state):
+    tempPath = path + '.tmp'
+    with open(tempPath, 'w', encoding='utf-8') as checkpointFile:
+        json.dump(state, checkpointFile, indent=2)
+    # 原子替换，写到一半中断也不会损坏旧的检查点
+    os.replace(tempPath, path)
+
+
+class Tuner:
+    """
+    坐标下降调优
+    """
+
+    def __init__(self, pool, games, seed, depth, max_moves, checkpoint,
+                 min_step=0.01):
+        self.pool = pool
+        self.games = games
+        self.seed = seed
+        self.depth = depth
+        self.maxMoves = max_moves
+        self.checkpoint = checkpoint
+        self.minStep = min_step
+        self.config = {'games': games, 'seed': seed, 'depth': depth,
+                       'maxMoves': max_moves}
+
+        state = loadCheckpoint(checkpoint) if checkpoint else None
+        if state is not None and state['config'] == self.config:
+            print('resume from %s (%d evaluations)' % (
+                checkpoint, len(state['history'])))
+        else:
+            state = {
+                'config': self.config,
+                'weights': dict(defaultWeights),
+                'steps': {name: max(abs(defaultWeights[name]) / 2, 0.1)
+                          for name in weightNames},
+                'bestScore': None,
+                'coordinate': 0,
+                'history': [],
+            }
+        self.state = state
+        # 已评估过的权重直接复用分数
+        self.cache = {self.key(h['weights']): h['score']
+                      for h in state['history']}
+
+    @staticmethod
+    def key(weights):
+        return tuple(round(weights[name], 6) for name in weightNames)
+
+    def fitness(self, weights):
+        """
+        固定种子跑一组对局，返回平均分
+        """
+        key = self.key(weights)
+        if key in self.cache:
+            return self.cache[key]
+
+        results, wall = runGames(self.games, self.seed, search_time=0,
+                                 max_depth=self.depth, max_moves=self.maxMoves,
+                                 weights=weights, pool=self.pool)
+        summary = summarize(results, wall)
+        score = summary['score']['mean']
+        self.cache[key] = score
+        self.state['history'].append({
+            'weights': dict(weights),
+            'score': score,
+            'median': summary['score']['median'],
+            'movesPerCpuSec': summary['movesPerCpuSec'],
+        })
+        print('%s -> mean %.0f median %.0f %.1f moves/s' % (
+            ' '.join('%s=%.4g' % (n, weights[n]) for n in weightNames), score,
+            summary['score']['median'], summary['movesPerCpuSec']))
+        return score
+
+    def save(self):
+        if self.checkpoint:
+            saveCheckpoint(self.checkpoint, self.state)
+
+    def run(self, max_evaluations):
+        state = self.state
+        if state['bestScore'] is None:
+            state['bestScore'] = self.fitness(state['weights'])
+            self.save()
+
+        while len(state['history']) < max_evaluations:
+            steps = state['steps']
+            if all(step < self.minStep for step in steps.values()):
+                print('converged')
+                break
+
+            name = weightNames[state['coordinate']]
+            if steps[name] >= self.minStep:
+                improved = False
+                for sign in (1, -1):
+                    # 评估次数用完时停在当前坐标，从检查点恢复后继续
+                    if len(state['history']) >= max_evaluations:
+                        self.save()
+                        return state['weights'], state['bestScore']
+                    candidate = dict(state['weights'])
+                    candidate[name] = max(candidate[name] + sign * steps[name],
+                                          0.0)
+                    score = self.fitness(candidate)
+                    if score > state['bestScore']:
+                        state['weights'] = candidate
+                        state['bestScore'] = score
+                        improved = True
+                        break
+                    self.save()
+                if not improved:
+                    steps[name] /= 2
+            state['coordinate'] = (state['coordinate'] + 1) % len(weightNames)
+            self.save()
+
+        return state['weights'], state['bestScore']
+
+
+def tradeoff(pool, weights, games, seed, depths, max_moves):
+    """
+    最佳权重在不同搜索深度下的 得分 / 吞吐 对照
+
+    :return: [{'depth', 'meanScore', 'medianScore', 'movesPerCpuSec',
+               'msPerMove', 'maxTileRates'}, ...]
+    """
+    rows = []
+    for depth in depths:
+        results, wall = runGames(games, seed, search_time=0, max_depth=depth,
+                                 max_moves=max_moves, weights=weights,
+                                 pool=pool)
+        summary = summarize(results, wall)
+        movesPerCpuSec = summary['movesPerCpuSec']
+        rows.append({
+            'depth': depth,
+            'meanScore': summary['score']['mean'],
+            'medianScore': summary['score']['median'],
+            'movesPerCpuSec': movesPerCpuSec,
+            'msPerMove': 1000 / movesPerCpuSec if movesPerCpuSec else 0.0,
+            'maxTileRates': summary['maxTileRates'],
+        })
+        print('depth %d mean %.0f median %.0f %.1f moves/s %.2fms/move' % (
+            depth, rows[-1]['meanScore'], rows[-1]['medianScore'],
+            movesPerCpuSec, rows[-1]['msPerMove']))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='2048 评估权重调优')
+    parser.add_argument('-n', '--games', type=int, default=16,
+                        help='每次评估的对局数')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='进程数，默认 CPU 核数')
+    parser.add_argument('--seed', type=int, default=0, help='起始种子')
+    parser.add_argument('--depth', type=int, default=1,
+                        help='调优时的搜索深度')
+    parser.add_argument('--max-moves', type=int, default=0,
+                        help='每局最大步数，0 表示不限')
+    parser.add_argument('--evaluations', type=int, default=100,
+                        help='最多评估多少组权重')
+    parser.add_argument('--checkpoint', default='tune2048.json',
+                        help='检查点文件')
+    parser.add_argument('--output', default='tune2048.best.json',
+                        help='最佳权重和吞吐对照输出文件')
+    parser.add_argument('--tradeoff-depths', default='1,2,3',
+                        help='吞吐对照使用的搜索深度，逗号分隔')
+    args = parser.parse_args(argv)
+
+    with createPool(args.workers) as pool:
+        tuner = Tuner(pool, args.games, args.seed, args.depth, args.max_moves,
+                      args.checkpoint)
+        weights, score = tuner.run(args.evaluations)
+        print('best %s mean %.0f' % (weights, score))
+        depths = [int(d) for d in args.tradeoff_depths.split(',') if d]
+        rows = tradeoff(pool, weights, args.games, args.seed, depths,
+                        args.max_moves)
+
+    with open(args.output, 'w', encoding='utf-8') as outputFile:
+        json.dump({'config': tuner.config, 'weights': weights,
+                   'meanScore': score, 'tradeoff': rows}, outputFile,
+                  indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,15 @@
 #! python3
 # Usage: 省|直辖市|特别行政区 市|县|区 选项[future|history|all]
 # Usage: python weather.py 北京 朝阳 all
+# Usage: python weather.py 全国 朝阳  或  python weather.py 朝阳  在全国范围查找
+# Usage: python weather.py --search 朝阳  列出匹配的站点，也可以用拼音 chaoyang / cy
+# Usage: python weather.py --build-stations  预先抓取全国站点字典
+# Usage: python weather.py --batch cities.txt -i all -f csv
+#        批量查询，见 weatherbatch.py
+# Usage: python weather.py --daemon 北京 朝阳 all
+#        通过常驻的 weatherd.py 查询，见 weatherd.py
 # 根据 https://weather.cma.cn/ 抓取城市天气信息
+# 站点字典缓存在本地，见 weatherstations.py
 #
 # 错误码
 # -1 省|直辖市|特别行政区 错误，长度不足
@@ -12,10 +20,9 @@
 
 import sys
 import json
-import pypinyin
-import requests
-from bs4 import BeautifulSoup
-import prettytable
+from weatherstations import StationCache, StationIndex
+
+# pypinyin、requests、bs4、prettytable 导入都很慢，只在用到的函数中导入
 
 headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 6.3; Win64; x64) AppleWebKit/537.36 \
@@ -23,136 +30,209 @@ headers = {
 city_link = 'https://weather.cma.cn/api/dict/province/'
 weather_link = 'https://weather.cma.cn/api/now/'
 average_link = 'https://weather.cma.cn/api/climate?stationid='
+future_link = 'https://weather.cma.cn/web/weather/'
 PROVINCES = ['AAH', 'AAM', 'ABJ', 'ACQ', 'AFJ', 'AGD', 'AGS', 'AGX', 'AGZ',
              'AHA', 'AHB', 'AHE', 'AHI', 'AHL', 'AHN', 'AJL', 'AJS', 'AJX',
              'ALN', 'ANM', 'ANX', 'AQH', 'ASC', 'ASD', 'ASH', 'ASN', 'ASX',
              'ATJ', 'ATW', 'AXG', 'AXJ', 'AXZ', 'AYN', 'AZJ']
+# 名字前两个字 -> 编码，拼音首字母规则对 河北 河南 海南 陕西 会得到其他省的编码
+PROVINCE_CODES = {
+    '安徽': 'AAH', '澳门': 'AAM', '北京': 'ABJ', '重庆': 'ACQ', '福建': 'AFJ',
+    '广东': 'AGD', '甘肃': 'AGS', '广西': 'AGX', '贵州': 'AGZ', '河南': 'AHA',
+    '湖北': 'AHB', '河北': 'AHE', '海南': 'AHI', '黑龙': 'AHL', '湖南': 'AHN',
+    '吉林': 'AJL', '江苏': 'AJS', '江西': 'AJX', '辽宁': 'ALN', '内蒙': 'ANM',
+    '宁夏': 'ANX', '青海': 'AQH', '四川': 'ASC', '山东': 'ASD', '上海': 'ASH',
+    '陕西': 'ASN', '山西': 'ASX', '天津': 'ATJ', '台湾': 'ATW', '香港': 'AXG',
+    '新疆': 'AXJ', '西藏': 'AXZ', '云南': 'AYN', '浙江': 'AZJ'}
+NATIONWIDE = '全国'
+station_cache = None
+station_index = None
+
+
+def get_station_cache():
+    global station_cache
+    if station_cache is None:
+        station_cache = StationCache(city_link, headers)
+    return station_cache
+
+
+def get_station_index():
+    global station_index
+    if station_index is None:
+        station_index = StationIndex(get_station_cache())
+    return station_index
+
+
+class LocationError(LookupError):
+    """
+    地区解析失败，code 为上面的错误码
+    """
 
+    def __init__(self, code, name):
+        super().__init__(code, name)
+        self.code = code
 
-def get_province_code(province):
+
+def lookup_province(province):
     """
     获取 省|直辖市|特别行政区 编码
-    规则：A + 前两个字拼音的首字符大写
+    先查 PROVINCE_CODES，没有时按规则：A + 前两个字拼音的首字符大写
 
-    :param province: 省|直辖市|特别行政区 名字
-    :return: 省|直辖市|特别行政区 编码
+    :param province: 省|直辖市|特别行政区 名字，'全国' 表示所有省份
+    :return: 省|直辖市|特别行政区 编码，全国时为编码列表
+    :raise LocationError: 错误码 -1 / -2
     """
     if len(province) < 2:
-        sys.exit(-1)
+        raise LocationError(-1, province)
+    if province == NATIONWIDE:
+        return PROVINCES
+
+    code = PROVINCE_CODES.get(province[:2])
+    if code is not None:
+        return code
 
+    import pypinyin
     code = 'A'
     for s in pypinyin.pinyin(province[:2], style=pypinyin.FIRST_LETTER):
         code += s[0].upper()
 
     if code not in PROVINCES:
-        sys.exit(-2)
+        raise LocationError(-2, province)
 
     return code
 
 
-def get_suitability(src_name, dst_name):
+def lookup_area(code, area):
     """
-    计算源区域名字与目标区域名字的匹配度，从第一个字开始匹配，粗略计算
+    根据 省|直辖市|特别行政区 编码查找站点
+    取与地区名字从第一个字开始相同字数最多的站点，相同时取先出现的
 
-    :param src_name: 源区域名字
-    :param dst_name: 目标区域名字
-    :return: 匹配数量
+    :param code: 省|直辖市|特别行政区 编码，或全国的编码列表
+    :param area: 地区名字，也可以是拼音全拼或首字母
+    :return: Station
+    :raise LocationError: 错误码 -3 / -4
     """
-    count = 0
-    for idx in range(len(src_name)):
-        if len(dst_name) < idx + 1:
-            break
+    if len(area) < 2:
+        raise LocationError(-3, area)
 
-        if src_name[idx] == dst_name[idx]:
-            count += 1
-        else:
-            break
-    return count
+    station = get_station_index().lookup(code, area)
+    if station is None:
+        raise LocationError(-4, area)
+
+    return station
+
+
+def get_province_code(province):
+    """
+    与 lookup_province 相同，出错时以错误码退出
+    """
+    try:
+        return lookup_province(province)
+    except LocationError as e:
+        sys.exit(e.code)
 
 
 def get_area_code(code, area):
     """
-    根据 省|直辖市|特别行政区 编码获取地区编码
+    与 lookup_area 相同，出错时以错误码退出
 
-    :param code: 省|直辖市|特别行政区 编码
-    :param area: 地区名字
     :return: 地区编码
     """
-    if len(area) < 2:
-        sys.exit(-3)
+    try:
+        station = lookup_area(code, area).station
+    except LocationError as e:
+        sys.exit(e.code)
+    warn_missing(code)
+    return station
 
-    link = city_link + code
-    r = requests.get(link, headers=headers)
-    r.raise_for_status()
-    # 获取 json 的 string
-    json_str = r.text
-    json_data = json.loads(json_str)
-    cities = {}
-    for cityInfo in json_data['data'].split('|'):
-        lst = cityInfo.split(',')
-        if len(lst) == 2:
-            cities[lst[1]] = lst[0]
 
-    suitability = 0  # 匹配数量
-    real_name = ""
-    for name in cities.keys():
-        count = get_suitability(area, name)
-        if count > suitability:
-            suitability = count
-            real_name = name
+def warn_missing(code):
+    """
+    全国查找时提示没有站点字典、未参与查找的省份
+    """
+    missing = get_station_index().missing(code)
+    if missing:
+        print('站点字典暂时不可用，未参与查找: {}'.format(','.join(missing)),
+              file=sys.stderr)
 
-    if suitability == 0:
-        sys.exit(-4)
 
-    return cities[real_name]
+def search_area(area, limit=10):
+    """
+    在全国范围列出匹配的站点
 
+    :param area: 地区名字，也可以是拼音全拼或首字母
+    :param limit: 最多列出的站点数
+    """
+    candidates = get_station_index().candidates(PROVINCES, area, limit)
+    for station, length in candidates:
+        print('{} {} {} {}'.format(station.station, station.province,
+                                   station.name, length))
+    warn_missing(PROVINCES)
 
-def get_weather(code):
+
+def fetch_weather(code):
     """
     根据地区编码获取天气信息
 
     :param code: 地区编码
+    :return: 接口返回的 now 字典，另加 path 地区路径
     """
 
+    import httpclient
     link = weather_link + str(code)
-    res = requests.get(link, headers=headers)
+    res = httpclient.get(link, headers=headers)
     res.raise_for_status()
     # 获取 json 的 string
     json_string = res.text
     json_data = json.loads(json_string)
-    comment_dict = json_data['data']['now']
-    print(json_data['data']['location']['path'].replace(",", ""))
-    print('温度 ' + str(comment_dict['temperature']) + '℃')
-    print('气压 ' + str(int(comment_dict['pressure'])) + 'hPa')
-    print('湿度 ' + str(int(comment_dict['humidity'])) + '%')
-    print(str(comment_dict['windDirection']) + str(comment_dict['windScale']))
+    now = dict(json_data['data']['now'])
+    now['path'] = json_data['data']['location']['path'].replace(",", "")
+    return now
 
 
-def get_future_info(code):
+def print_weather(now):
+    print(now['path'])
+    print('温度 ' + str(now['temperature']) + '℃')
+    print('气压 ' + str(int(now['pressure'])) + 'hPa')
+    print('湿度 ' + str(int(now['humidity'])) + '%')
+    print(str(now['windDirection']) + str(now['windScale']))
+
+
+def get_weather(code):
+    print_weather(fetch_weather(code))
+
+
+def fetch_future_info(code):
     """
     根据地区编码获取未来天气信息
 
     :param code: 地区编码
+    :return: 表格的行，第一行为表头
     """
 
-    res = requests.get('https://weather.cma.cn/web/weather/' + str(code)
-                       + '.html')
-    res.encoding = res.apparent_encoding
+    import httpclient
+    import htmlextract
+    res = httpclient.get(future_link + str(code) + '.html')
     res.raise_for_status()
-    beautiful_soup = BeautifulSoup(res.text, 'html.parser')
-    hour_table_elements = beautiful_soup.select('#hourTable_0')
+    document = htmlextract.parse(httpclient.text(res), ['#hourTable_0'])
+    hour_table_elements = document.select('#hourTable_0')
     row_elements = hour_table_elements[0].select('tr')
-    print()
-    print('未来天气情况')
     rows = []
     for row_element in row_elements:
         grid_elements = row_element.select('td')
-        if grid_elements[0].getText().strip() != '天气':
+        if grid_elements[0].text().strip() != '天气':
             for idx in range(len(grid_elements)):
                 grid_element = grid_elements[idx]
                 if len(rows) < idx + 1:
                     rows.append([])
-                rows[idx].append(grid_element.getText().strip())
+                rows[idx].append(grid_element.text().strip())
+    return rows
+
+
+def print_future_info(rows):
+    print()
+    print('未来天气情况')
+    import prettytable
     pb = prettytable.PrettyTable()
     for idx in range(len(rows)):
         if idx == 0:
@@ -162,23 +242,32 @@ def get_future_info(code):
     print(pb)
 
 
-def get_average_info(code):
+def get_future_info(code):
+    print_future_info(fetch_future_info(code))
+
+
+def fetch_average_info(code):
     """
     根据地区编码获取年月平均气温和降水信息
 
     :param code: 地区编码
+    :return: {'beginYear', 'endYear', 'data': [每月的字典]}
     """
+    import httpclient
     link = average_link + str(code)
-    res = requests.get(link, headers=headers)
+    res = httpclient.get(link, headers=headers)
     res.raise_for_status()
     # 获取 json 的 string
     json_string = res.text
     json_data = json.loads(json_string)
-    begin_year = json_data['data']['beginYear']
-    end_year = json_data['data']['endYear']
-    comment_list = json_data['data']['data']
+    return json_data['data']
+
+
+def print_average_info(info):
+    comment_list = info['data']
     print()
-    print("{}年-{}年月平均气温和降水".format(begin_year, end_year))
+    print("{}年-{}年月平均气温和降水".format(info['beginYear'], info['endYear']))
+    import prettytable
     pb = prettytable.PrettyTable()
     pb.field_names = ['月份', '最低温度', '最高温度', '雨量']
 
@@ -194,28 +283,88 @@ def get_average_info(code):
     print(pb)
 
 
+def get_average_info(code):
+    print_average_info(fetch_average_info(code))
+
+
+# 各部分数据的抓取函数
+fetchers = {
+    'now': fetch_weather,
+    'future': fetch_future_info,
+    'history': fetch_average_info,
+}
+commands = {'future': ['future'], 'history': ['history'],
+            'all': ['future', 'history']}
+
+
+def report(code, command=None, fetch=None):
+    """
+    输出地区的天气信息
+
+    :param code: 地区编码
+    :param command: None 或 future|history|all
+    :param fetch: fetch(部分, 地区编码) -> 数据，部分为 fetchers 的键，
+                  默认直接抓取，守护进程客户端改为向守护进程请求
+    """
+    if fetch is None:
+        def fetch(item, code):
+            return fetchers[item](code)
+    print_weather(fetch('now', code))
+    if command is None:
+        return
+    items = commands.get(command.lower())
+    if items is None:
+        error_notice()
+        return
+    printers = {'future': print_future_info, 'history': print_average_info}
+    for item in items:
+        printers[item](fetch(item, code))
+
+
 def error_notice():
     """
     参数错误提示
     """
     print('Usage: 省|直辖市|特别行政区 市|县|区 选项[future|history|all]')
     print('Usage: python weather.py 北京 朝阳 all')
-
-
-if len(sys.argv) >= 3:
-    province_code = get_province_code(sys.argv[1])
-    area_code = get_area_code(province_code, sys.argv[2])
-    get_weather(area_code)
-    if len(sys.argv) >= 4:
-        command = sys.argv[3].lower()
-        if command == 'future':
-            get_future_info(area_code)
-        elif command == 'history':
-            get_average_info(area_code)
-        elif command == 'all':
-            get_future_info(area_code)
-            get_average_info(area_code)
-        else:
-            error_notice()
-else:
-    error_notice()
+    print('Usage: python weather.py 全国 朝阳 all')
+    print('Usage: python weather.py --search 朝阳')
+    print('Usage: python weather.py --batch 地区列表文件|- [-i now,future,history] '
+          '[-f jsonl|csv] [-w 8] [-o 输出文件]')
+    print('Usage: python weather.py --daemon 北京 朝阳 all')
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == '--build-stations':
+        count = get_station_cache().build(PROVINCES, force='--force' in argv)
+        print('{} 个省份已更新，缓存文件 {}'.format(count, station_cache.path))
+        for code, (_, error) in sorted(station_cache.failures.items()):
+            print('{} 抓取失败: {}'.format(code, error))
+        return
+
+    if argv and argv[0] == '--batch':
+        import weatherbatch
+        sys.exit(weatherbatch.main(argv[1:]))
+
+    if argv and argv[0] == '--daemon':
+        import weatherd
+        weatherd.query(argv[1:])
+        return
+
+    if len(argv) >= 2 and argv[0] == '--search':
+        search_area(argv[1])
+        return
+    if len(argv) == 1 and not argv[0].startswith('-'):
+        argv = [NATIONWIDE] + argv
+
+    if len(argv) >= 2:
+        province_code = get_province_code(argv[0])
+        area_code = get_area_code(province_code, argv[1])
+        report(area_code, argv[2] if len(argv) >= 3 else None)
+    else:
+        error_notice()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#! python3
+# 批量查询多个地区的天气
+# 地区列表每行一个: '省 地区'、'地区'(在全国范围查找) 或站点编码，# 开头的行和空行忽略
+# 地区全部用本地站点字典解析，缺少的省份先并发抓取一次
+# 每个地区的实时 / 未来 / 历史数据在线程池中并发抓取，同时进行的地区数有上限，
+# 结果按输入顺序逐行输出为 JSON lines 或 CSV，结束时在 stderr 输出吞吐量统计
+#
+# python weather.py --batch cities.txt -i now,future -f csv -o out.csv
+# cat cities.txt | python weatherbatch.py - -w 16
+#
+
+import io
+import sys
+import csv
+import json
+import time
+import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import httpclient
+import weather
+from weatherstations import Station, StationsUnavailable
+
+items = list(weather.fetchers)
+output_formats = ['jsonl', 'csv']
+# CSV 中实时天气的列，未来和历史数据以 JSON 字符串放在一列中
+now_fields = ['path', 'temperature', 'pressure', 'humidity', 'windDirection',
+              'windScale']
+
+
+def read_locations(lines):
+    """
+    :param lines: 地区列表的行
+    :return: 迭代 (原始查询, [省, 地区] 或 [地区] 或 [站点编码])
+    """
+    for line in lines:
+        query = line.strip()
+        if not query or query.startswith('#'):
+            continue
+        yield query, query.replace(',', ' ').split()
+
+
+def resolve(parts):
+    """
+    :param parts: read_locations 返回的查询
+    :return: (Station, 没有站点字典、未参与查找的省份编码)
+    :raise LocationError: 与命令行相同的错误码
+    """
+    if len(parts) == 1 and parts[0].isdigit():
+        return Station('', parts[0], ''), []
+    if len(parts) == 1:
+        parts = [weather.NATIONWIDE] + parts
+    province = weather.lookup_province(parts[0])
+    station = weather.lookup_area(province, parts[1])
+    return station, weather.get_station_index().missing(province)
+
+
+def future_records(rows):
+    """
+    未来天气表格转为字典列表，键为表头
+    """
+    return [dict(zip(rows[0], row)) for row in rows[1:]] if rows else []
+
+
+def fetch_location(station, what):
+    """
+    抓取一个地区的数据，在线程池中运行
+
+    :param station: Station
+    :param what: items 中需要抓取的部分
+    :return: {部分: 数据}
+    """
+    data = {}
+    for item in what:
+        value = weather.fetchers[item](station.station)
+        data[item] = future_records(value) if item == 'future' else value
+    return data
+
+
+def bounded_map(executor, fn, args, window):
+    """
+    与 executor.map 相同，按输入顺序返回结果，但最多只提交 window 个任务，
+    输入可以是很长的流，已完成的结果立即交给调用者
+
+    :return: 迭代 (参数, Future)
+    """
+    pending = collections.deque()
+    for arg in args:
+        pending.append((arg, executor.submit(fn, *arg)))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+class RecordWriter:
+    """
+    逐条输出结果
+    """
+
+    def __init__(self, out, output_format, what):
+        self.out = out
+        self.format = output_format
+        self.what = what
+        self.csv = None
+        if output_format == 'csv':
+            fields = ['query', 'province', 'name', 'station']
+            if 'now' in what:
+                fields += now_fields
+            fields += [item for item in what if item != 'now']
+            fields += ['unavailable', 'error']
+            self.csv = csv.DictWriter(out, fields, extrasaction='ignore')
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv is None:
+            self.out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        else:
+            row = dict(record)
+            row.update(record.get('now') or {})
+            for item in self.what:
+                if item != 'now' and item in record:
+                    row[item] = json.dumps(record[item], ensure_ascii=False)
+            self.csv.writerow(row)
+        self.out.flush()
+
+
+def run_batch(lines, out, what=items, output_format='jsonl', workers=8):
+    """
+    :param lines: 地区列表的行
+    :param out: 输出文件对象
+    :param what: 需要抓取的部分
+    :param output_format: output_formats 之一
+    :param workers: 同时抓取的地区数
+    :return: (地区数, 失败数)
+    """
+    # 先把缺失或过期的省份一次并发抓齐，之后解析地区不再联网
+    # 抓取失败的省份继续使用旧数据，没有数据时该省的查询失败，
+    # 全国范围的查询跳过该省，在 unavailable 中列出
+    # 每个地区的请求依次进行，同时进行的请求数等于 workers
+    httpclient.configure(workers)
+    cache = weather.get_station_cache()
+    if not all(cache.is_fresh(code) for code in weather.PROVINCES):
+        cache.build(weather.PROVINCES, workers)
+    writer = RecordWriter(out, output_format, what)
+    count = errors = 0
+
+    def tasks():
+        for query, parts in read_locations(lines):
+            record = {'query': query}
+            try:
+                station, missing = resolve(parts)
+            except weather.LocationError as e:
+                record['error'] = 'location error %d' % e.code
+                yield record, None
+                continue
+            except StationsUnavailable as e:
+                record['error'] = 'stations unavailable: %s' % e
+                yield record, None
+                continue
+            record.update(province=station.province, name=station.name,
+                          station=station.station)
+            if missing:
+                record['unavailable'] = ','.join(missing)
+            yield record, station
+
+    def work(record, station):
+        return fetch_location(station, what) if station else None
+
+    with ThreadPoolExecutor(workers) as executor:
+        for (record, station), future in bounded_map(
+                executor, work, tasks(), workers * 2):
+            try:
+                data = future.result()
+            except (requests.RequestException, ValueError, KeyError,
+                    IndexError) as e:
+                record['error'] = '%s: %s' % (type(e).__name__, e)
+            else:
+                if data:
+                    record.update(data)
+            count += 1
+            errors += 'error' in record
+            writer.write(record)
+    return count, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量查询多个地区的天气')
+    parser.add_argument('input', help='地区列表文件，- 表示标准输入')
+    parser.add_argument('-i', '--items', default='now',
+                        help='逗号分隔的 now,future,history 或 all，'
+                             '默认 now')
+    parser.add_argument('-f', '--format', choices=output_formats,
+                        default='jsonl', help='输出格式，默认 jsonl')
+    parser.add_argument('-w', '--workers', type=int, default=8,
+                        help='同时抓取的地区数，默认 8')
+    parser.add_argument('-o', '--output', default=None,
+                        help='输出文件，默认标准输出')
+    args = parser.parse_args(argv)
+
+    what = items if args.items == 'all' else args.items.split(',')
+    unknown = set(what) - set(items)
+    if unknown:
+        parser.error('unknown items: %s' % ','.join(sorted(unknown)))
+    if args.input == '-':
+        lines = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    else:
+        lines = open(args.input, encoding='utf-8')
+    out = (open(args.output, 'w', encoding='utf-8', newline='')
+           if args.output else sys.stdout)
+
+    start = time.perf_counter()
+    try:
+        with lines:
+            count, errors = run_batch(lines, out, what, args.format,
+                                      args.workers)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    requests_made = sum(s['requests'] for s in httpclient.stats().values())
+    print('%d locations, %d errors, %d requests in %.2f s: '
+          '%.1f locations/s, %.1f requests/s' % (
+              count, errors, requests_made, elapsed,
+              count / elapsed if elapsed else 0,
+              requests_made / elapsed if elapsed else 0), file=sys.stderr)
+    print(httpclient.summary(), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
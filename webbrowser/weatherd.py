@@ -0,0 +1,315 @@
+#! python3
+# 天气查询守护进程
+# 常驻进程，站点字典、实时天气、未来天气和历年气候数据都缓存在内存中，各自有有效期
+# 多个请求同时查询同一个站点的同一部分时只向上游抓取一次，其他请求等待结果
+# 只监听本机，接口返回 JSON:
+#   /resolve?province=北京&area=朝阳  解析地区，失败时返回 weather.py 的错误码
+#     全国查找时 unavailable 列出没有站点字典、未参与查找的省份
+#   /now/站点编码  /future/站点编码  /history/站点编码
+#   /stats  各缓存的命中统计
+#
+# 启动: python weatherd.py --port 8787
+# 查询: python weather.py --daemon 北京 朝阳 all  输出与直接查询相同
+# 守护进程地址默认 http://127.0.0.1:8787，可以用环境变量 WEATHER_DAEMON 修改
+#
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import weather
+
+default_port = 8787
+default_url = 'http://127.0.0.1:%d' % default_port
+# 各部分的默认有效期(秒)，气候数据是多年平均值，几乎不会变化
+default_ttls = {'now': 300, 'future': 1800, 'history': 7 * 24 * 3600}
+max_entries = 10000  # 每个缓存最多保存的站点数
+
+
+class Flight:
+    """
+    正在进行的上游请求，等待者共享它的结果
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+    def finish(self, value=None, error=None):
+        self.value = value
+        self.error = error
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class TTLCache:
+    """
+    带有效期的缓存，同一个键同时只加载一次，加载失败不缓存
+    """
+
+    def __init__(self, ttl, limit=max_entries):
+        """
+        :param ttl: 有效期(秒)
+        :param limit: 最多保存的条目数，超过时先删除过期的，再删除最早加入的
+        """
+        self.ttl = ttl
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.entries = {}  # 键 -> (过期时间, 值)
+        self.flights = {}  # 键 -> Flight
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0  # 等待其他请求加载的次数
+        self.errors = 0
+
+    def get(self, key, load):
+        """
+        :param key: 键
+        :param load: load(key) -> 值，缓存中没有或已过期时调用
+        :return: 值
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.misses += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            return flight.wait()
+
+        try:
+            value = load(key)
+        except Exception as e:
+            with self.lock:
+                del self.flights[key]
+                self.errors += 1
+            flight.finish(error=e)
+            raise
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            del self.flights[key]
+            if len(self.entries) > self.limit:
+                self.evict()
+        flight.finish(value)
+        return value
+
+    def evict(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self.entries.items()
+                    if entry[0] <= now]:
+            del self.entries[key]
+        while len(self.entries) > self.limit:
+            del self.entries[next(iter(self.entries))]
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits,
+                    'misses': self.misses, 'collapsed': self.collapsed,
+                    'errors': self.errors}
+
+
+class WeatherHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次发送，保持连接时 Nagle 算法会让响应体等待 ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path.strip('/').split('/')
+        server = self.server
+        if path == ['resolve']:
+            query = {name: values[0]
+                     for name, values in parse_qs(parts.query).items()}
+            try:
+                station = server.resolve(query.get('province', ''),
+                                         query.get('area', ''))
+            except weather.LocationError as e:
+                self.reply(404, {'error': 'location', 'code': e.code})
+            except Exception as e:
+                self.reply(502, {'error': '%s: %s' % (type(e).__name__, e)})
+            else:
+                self.reply(200, station)
+        elif path == ['stats']:
+            self.reply(200, server.stats())
+        elif len(path) == 2 and path[0] in server.caches:
+            if not path[1].isalnum():
+                self.reply(400, {'error': 'bad station'})
+                return
+            try:
+                data = server.caches[path[0]].get(path[1],
+                                                  weather.fetchers[path[0]])
+            except Exception as e:
+                self.reply(502, {'error': '%s: %s' % (type(e).__name__, e)})
+            else:
+                self.reply(200, data)
+        else:
+            self.reply(404, {'error': 'not found'})
+
+    def reply(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class WeatherServer(ThreadingHTTPServer):
+    """
+    天气查询服务，每个请求一个线程
+    """
+
+    daemon_threads = True
+    request_queue_size = 128  # 默认的 5 在并发连接多时会丢弃连接请求
+
+    def __init__(self, host='127.0.0.1', port=default_port, ttls=None):
+        """
+        :param host: 监听地址
+        :param port: 端口，0 表示随机
+        :param ttls: {部分: 有效期(秒)}，未指定的部分使用 default_ttls
+        """
+        super().__init__((host, port), WeatherHandler)
+        ttls = dict(default_ttls, **(ttls or {}))
+        self.caches = {item: TTLCache(ttls[item]) for item in weather.fetchers}
+        # 站点字典和前缀树不是线程安全的，解析地区时加锁
+        self.resolveLock = threading.Lock()
+        self.resolves = 0
+        self.started = time.time()
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def resolve(self, province, area):
+        """
+        :return: Station 的字典，全国查找跳过了没有站点字典的省份时，
+            unavailable 列出这些省份
+        :raise LocationError: 与命令行相同的错误码
+        """
+        with self.resolveLock:
+            self.resolves += 1
+            code = weather.lookup_province(province)
+            result = weather.lookup_area(code, area)._asdict()
+            missing = weather.get_station_index().missing(code)
+            if missing:
+                result['unavailable'] = missing
+            return result
+
+    def stats(self):
+        result = {item: cache.stats() for item, cache in self.caches.items()}
+        result['resolves'] = self.resolves
+        result['uptime'] = round(time.time() - self.started, 1)
+        return result
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def request(url, path, params=None):
+    """
+    向守护进程发送请求，客户端只用标准库，不导入 requests
+
+    :return: (状态码, JSON 数据)
+    """
+    import urllib.request
+    import urllib.error
+    link = url.rstrip('/') + path
+    if params:
+        link += '?' + urlencode(params)
+    # 守护进程在本机，不经过代理
+    opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+    try:
+        with opener.open(link, timeout=60) as res:
+            return res.status, json.loads(res.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, json.loads(e.read().decode('utf-8'))
+
+
+def query(argv, url=None):
+    """
+    通过守护进程查询，参数和输出与 weather.py 相同
+
+    :param argv: 省|直辖市|特别行政区 市|县|区 [future|history|all]
+    :param url: 守护进程地址，默认为环境变量 WEATHER_DAEMON 或 default_url
+    """
+    url = url or os.environ.get('WEATHER_DAEMON', default_url)
+    if len(argv) == 1 and not argv[0].startswith('-'):
+        argv = [weather.NATIONWIDE] + argv
+    if len(argv) < 2:
+        weather.error_notice()
+        return
+
+    def fetch(item, code):
+        status, data = request(url, '/%s/%s' % (item, code))
+        if status != 200:
+            sys.exit('weatherd: %s' % data.get('error'))
+        return data
+
+    try:
+        status, data = request(url, '/resolve',
+                               {'province': argv[0], 'area': argv[1]})
+    except OSError as e:
+        sys.exit('weatherd: %s 无法连接 (%s)，先运行 python weatherd.py' % (
+            url, e))
+    if status == 404 and 'code' in data:
+        sys.exit(data['code'])
+    if status != 200:
+        sys.exit('weatherd: %s' % data.get('error'))
+    if data.get('unavailable'):
+        print('站点字典暂时不可用，未参与查找: {}'.format(
+            ','.join(data['unavailable'])), file=sys.stderr)
+    weather.report(data['station'], argv[2] if len(argv) >= 3 else None,
+                   fetch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='天气查询守护进程')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=default_port,
+                        help='端口，默认 %d' % default_port)
+    for item, ttl in default_ttls.items():
+        parser.add_argument('--%s-ttl' % item, type=float, default=ttl,
+                            help='%s 缓存有效期(秒)，默认 %d' % (item, ttl))
+    args = parser.parse_args(argv)
+
+    server = WeatherServer(args.host, args.port, {
+        item: getattr(args, '%s_ttl' % item) for item in default_ttls})
+    print('weatherd listening on %s' % server.url)
+    # kill 停止时同样输出统计
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
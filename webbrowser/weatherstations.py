@@ -0,0 +1,353 @@
+#! python3
+# 气象站字典缓存
+# 各 省|直辖市|特别行政区 的站点列表几乎不会变化，缓存到本地文件，解析地区名不需要联网
+# 缓存按省记录抓取时间，超过有效期才重新抓取，抓取失败时继续使用过期的数据
+# 抓取失败的省份在 retry_interval 内不再重试，没有任何数据时查询该省抛出 StationsUnavailable，
+# 全国查找跳过这样的省份，StationIndex.missing() 列出被跳过的省份
+# 文件格式: JSON，每个省保存接口返回的原始字符串 '站点编码,名字|站点编码,名字|...'
+# 地区名查找用前缀树，可以在单个省内或全国查找，也可以用拼音全拼或首字母查找
+#
+# 预先抓取全部省份: python weather.py --build-stations
+# 缓存有效时不需要联网，httpclient / requests 在需要抓取时才导入
+#
+
+import os
+import json
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+cache_version = 1
+cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'weather.stations')
+station_ttl = 30 * 24 * 3600  # 30 天
+retry_interval = 60  # 抓取失败后多久再重试(秒)
+
+Station = collections.namedtuple('Station', ['name', 'station', 'province'])
+
+
+def parse_stations(data):
+    """
+    :param data: 接口返回的 '站点编码,名字|...'
+    :return: {名字: 站点编码}，保持接口中的顺序
+    """
+    stations = {}
+    for station_info in data.split('|'):
+        lst = station_info.split(',')
+        if len(lst) == 2:
+            stations[lst[1]] = lst[0]
+    return stations
+
+
+class StationsUnavailable(LookupError):
+    """
+    省份的站点列表抓取失败，且本地没有可用的旧数据
+    """
+
+    def __init__(self, code, error):
+        super().__init__(code, error)
+        self.code = code
+        self.error = error
+
+    def __str__(self):
+        return '%s: %s: %s' % (self.code, type(self.error).__name__,
+                               self.error)
+
+
+class StationCache:
+    """
+    全国站点字典
+    """
+
+    def __init__(self, link, headers=None, path=cache_path, ttl=station_ttl):
+        """
+        :param link: 站点列表接口，后面拼接省份编码
+        :param headers: 请求头
+        :param path: 缓存文件，None 表示只缓存在内存中
+        :param ttl: 有效期(秒)
+        """
+        self.link = link
+        self.headers = headers
+        self.path = path
+        self.ttl = ttl
+        self.provinces = {}  # 省份编码 -> {'fetched': 时间戳, 'data': 原始字符串}
+        self.parsed = {}  # 省份编码 -> {名字: 站点编码}
+        self.failures = {}  # 省份编码 -> (失败时间戳, 异常)
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as cache_file:
+                content = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if content.get('version') == cache_version:
+            self.provinces = content['provinces']
+
+    def save(self):
+        if self.path is None:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'version': cache_version, 'provinces': self.provinces},
+                      cache_file, ensure_ascii=False, separators=(',', ':'))
+        os.replace(temp_path, self.path)
+
+    def fetch(self, code):
+        """
+        抓取一个省的站点列表
+
+        :param code: 省份编码
+        :return: 原始字符串
+        """
+        import httpclient
+        r = httpclient.get(self.link + code, headers=self.headers)
+        r.raise_for_status()
+        return json.loads(httpclient.text(r))['data']
+
+    def is_fresh(self, code):
+        entry = self.provinces.get(code)
+        return entry is not None and time.time() - entry['fetched'] < self.ttl
+
+    def update(self, code, data):
+        self.provinces[code] = {'fetched': time.time(), 'data': data}
+        self.parsed.pop(code, None)
+        self.failures.pop(code, None)
+
+    def fail(self, code, error):
+        self.failures[code] = (time.time(), error)
+
+    def should_retry(self, code):
+        failure = self.failures.get(code)
+        return failure is None or time.time() - failure[0] >= retry_interval
+
+    def stations(self, code):
+        """
+        :param code: 省份编码
+        :return: {名字: 站点编码}
+        :raise StationsUnavailable: 抓取失败且没有旧数据
+        """
+        if not self.is_fresh(code) and self.should_retry(code):
+            import requests
+            try:
+                self.update(code, self.fetch(code))
+            except (requests.RequestException, ValueError, KeyError) as e:
+                self.fail(code, e)
+            else:
+                self.save()
+        if code not in self.provinces:
+            raise StationsUnavailable(code, self.failures[code][1])
+        parsed = self.parsed.get(code)
+        if parsed is None:
+            parsed = self.parsed[code] = parse_stations(
+                self.provinces[code]['data'])
+        return parsed
+
+    def build(self, codes, workers=8, force=False):
+        """
+        抓取所有省份并保存
+        单个省份失败时保留旧数据，记录在 failures 中，其余省份照常更新和保存
+
+        :param codes: 省份编码列表
+        :param workers: 同时进行的请求数
+        :param force: 忽略有效期全部重新抓取
+        :return: 更新成功的省份数
+        """
+        import requests
+        todo = [code for code in codes if force or not self.is_fresh(code)]
+        updated = 0
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [(code, executor.submit(self.fetch, code))
+                       for code in todo]
+            for code, future in futures:
+                try:
+                    self.update(code, future.result())
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    self.fail(code, e)
+                else:
+                    updated += 1
+        if updated:
+            self.save()
+        return updated
+
+
+def pinyin_keys(name, limit=16):
+    """
+    多音字的每种读音都加入，例如 朝阳 既可以用 zhaoyang 也可以用 chaoyang 查找
+
+    >>> pinyin_keys('朝阳')
+    ['zhaoyang', 'zy', 'chaoyang', 'cy']
+
+    :param limit: 读音组合的上限，第一种读音总在其中
+    :return: [全拼, 首字母, ...]，小写，不重复
+    """
+    import itertools
+    import pypinyin
+    readings = pypinyin.pinyin(name, style=pypinyin.NORMAL, heteronym=True)
+    keys = []
+    for combo in itertools.islice(itertools.product(*readings), limit):
+        full = ''.join(combo).lower()
+        initials = ''.join(s[:1] for s in combo).lower()
+        for key in (full, initials):
+            if key not in keys:
+                keys.append(key)
+    return keys
+
+
+def is_pinyin(query):
+    return query.isascii() and query.isalpha()
+
+
+class StationTrie:
+    """
+    站点名前缀树
+    每个节点记录子树中的站点序号(按加入顺序)，沿查询串走一遍就能找到最长公共前缀，
+    最深节点的第一个站点就是原来逐个比较时最先出现的最佳匹配
+    """
+
+    def __init__(self):
+        self.root = {}  # 字符 -> 子节点，'' -> 子树中的站点序号列表
+        self.entries = []  # [Station]
+
+    def insert(self, station, keys):
+        """
+        :param station: Station
+        :param keys: 查找用的字符串，例如名字、拼音
+        """
+        index = len(self.entries)
+        self.entries.append(station)
+        for key in keys:
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+                items = node.setdefault('', [])
+                if not items or items[-1] != index:
+                    items.append(index)
+
+    def walk(self, query):
+        """
+        :return: 查询串经过的节点，长度即最长公共前缀的长度
+        """
+        path = []
+        node = self.root
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                break
+            path.append(node)
+        return path
+
+    def longest(self, query):
+        """
+        :return: (Station, 匹配长度)，没有公共前缀时返回 None
+        """
+        path = self.walk(query)
+        if not path:
+            return None
+        return self.entries[path[-1][''][0]], len(path)
+
+    def candidates(self, query, limit=10):
+        """
+        按匹配长度从长到短列出候选站点，同样长度时完全匹配、名字短、先出现的优先
+
+        :return: [(Station, 匹配长度)]
+        """
+        path = self.walk(query)
+        result = []
+        seen = set()
+        for depth in range(len(path), 0, -1):
+            level = [index for index in path[depth - 1]['']
+                     if index not in seen]
+            level.sort(key=lambda index: (
+                self.entries[index].name != query,
+                len(self.entries[index].name), index))
+            for index in level:
+                seen.add(index)
+                result.append((self.entries[index], depth))
+                if len(result) >= limit:
+                    return result
+        return result
+
+
+class StationIndex:
+    """
+    单个省和全国的前缀树，站点字典更新后自动重建
+    """
+
+    def __init__(self, cache):
+        """
+        :param cache: StationCache
+        """
+        self.cache = cache
+        self.tries = {}  # (省份编码, 是否含拼音) -> (数据来源, StationTrie)
+
+    def build(self, sources, pinyin):
+        trie = StationTrie()
+        for code, stations in sources:
+            for name, station in stations.items():
+                keys = [name] + (pinyin_keys(name) if pinyin else [])
+                trie.insert(Station(name, station, code), keys)
+        return trie
+
+    def sources(self, codes):
+        """
+        多个省份时跳过没有数据的省份，用 missing() 查看，全部没有数据时才失败
+
+        :return: [(省份编码, {名字: 站点编码})]
+        :raise StationsUnavailable: 单个省份或所有省份都没有数据
+        """
+        if len(codes) == 1:
+            return [(codes[0], self.cache.stations(codes[0]))]
+        sources = []
+        error = None
+        for code in codes:
+            try:
+                sources.append((code, self.cache.stations(code)))
+            except StationsUnavailable as e:
+                error = error or e
+        if not sources:
+            raise error
+        return sources
+
+    def missing(self, codes):
+        """
+        :param codes: 省份编码，单个字符串或全国的列表
+        :return: 上次查找时没有数据、未参与查找的省份编码
+        """
+        codes = [codes] if isinstance(codes, str) else codes
+        return [code for code in codes if code not in self.cache.provinces]
+
+    def trie(self, codes, pinyin=False):
+        """
+        :param codes: 省份编码，单个字符串或全国的列表
+        :param pinyin: 是否加入拼音
+        """
+        codes = [codes] if isinstance(codes, str) else list(codes)
+        key = (tuple(codes), pinyin)
+        sources = self.sources(codes)
+        cached = self.tries.get(key)
+        if cached is not None and len(cached[0]) == len(sources) and all(
+                a[0] == b[0] and a[1] is b[1]
+                for a, b in zip(cached[0], sources)):
+            return cached[1]
+        trie = self.build(sources, pinyin)
+        self.tries[key] = (sources, trie)
+        return trie
+
+    def lookup(self, codes, area):
+        """
+        :param codes: 省份编码，或全国的省份编码列表
+        :param area: 地区名，纯字母时按拼音查找
+        :return: Station，没有公共前缀时返回 None
+        """
+        pinyin = is_pinyin(area)
+        match = self.trie(codes, pinyin).longest(
+            area.lower() if pinyin else area)
+        return match[0] if match else None
+
+    def candidates(self, codes, area, limit=10):
+        pinyin = is_pinyin(area)
+        return self.trie(codes, pinyin).candidates(
+            area.lower() if pinyin else area, limit)